@@ -0,0 +1,310 @@
+# benchmark.py
+# Headless benchmark of a dashboard refresh cycle.
+#
+# Builds the Weather, Surf, Wind, News and Clock panels against canned
+# provider data and times construction, data ingest, plot redraw and
+# canvas.draw() per panel over many cycles. Runs under Xvfb when it is
+# installed and there is no display; otherwise (or with --offscreen) only
+# the plots are benchmarked, on an Agg canvas.
+#
+# --soak runs the whole FullscreenWindow for that many minutes on replayed
+# provider data (recorded with record_dir, or canned), --time-scale times
+# faster than real time, and reports throughput, event-loop lag and memory.
+#
+#   python benchmark.py --cycles 200
+#   python benchmark.py --offscreen --unchanged
+#   python benchmark.py --renderer spark
+#   python benchmark.py --soak 10 --time-scale 500 --failure-rate 0.05
+
+import argparse
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+import smartmirror
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+rng = np.random.default_rng(0)
+
+
+def canned_weather(cycle):
+    days = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday', 'Monday']
+    low = 8 + rng.integers(0, 4, len(days))
+    return {'temp_c': 12 + cycle % 5,
+            'weather_now': 'clear',
+            'next_days': [{'name': name, 'min_temp_c': int(lo), 'max_temp_c': int(lo + 6 + cycle % 3)}
+                          for name, lo in zip(days, low)]}
+
+
+def canned_surf(cycle):
+    index = pd.date_range('2022-07-25', periods=7 * 24, freq='h') + pd.Timedelta(hours=cycle)
+    heights = 3 + np.sin(np.arange(len(index)) / 12.) + rng.normal(0, 0.2, len(index))
+    return pd.DataFrame({'Wave Avg Height [ft]': heights}, index=index)
+
+
+def canned_wind(cycle):
+    index = pd.date_range('2022-07-25', periods=3 * 24, freq='h') + pd.Timedelta(hours=cycle)
+    speeds = 12 + 8 * np.sin(np.arange(len(index)) / 4.) + rng.normal(0, 1, len(index))
+    return pd.DataFrame({'Wind Speed [mph]': speeds}, index=index)
+
+
+def canned_news(cycle):
+    return [{'title': 'Headline %i of cycle %i' % (idx, cycle), 'link': ''} for idx in range(20)]
+
+
+canned = {'weather': canned_weather, 'surf': canned_surf, 'wind': canned_wind, 'news': canned_news}
+
+
+class CannedSource:
+    # stands in for DataSource: no scrapers, no snapshots, no history, nothing cached
+    def __init__(self):
+        self.history = None
+
+    def peek(self, provider, location):
+        return None
+
+
+class CannedScheduler:
+    # the benchmark feeds the panels itself, so watching is a no-op
+    def __init__(self):
+        self.source = CannedSource()
+
+    def watch(self, provider, location, callback, errback=None):
+        pass
+
+
+class DeferredAggCanvas(FigureCanvasAgg):
+    # like TkAgg, leave rendering to an explicit draw() so the redraw and
+    # canvas.draw phases are timed separately
+    def draw_idle(self, *args, **kwargs):
+        pass
+
+
+class OffscreenPlot(smartmirror.ForecastPlot):
+    def make_canvas(self, parent):
+        return DeferredAggCanvas(self.fig)
+
+
+class Timings:
+    def __init__(self):
+        self.samples = {}
+
+    def add(self, widget, phase, seconds):
+        self.samples.setdefault((widget, phase), []).append(seconds * 1000.)
+
+    def time(self, widget, phase, func, *args):
+        start = time.perf_counter()
+        value = func(*args)
+        self.add(widget, phase, time.perf_counter() - start)
+        return value
+
+    def report(self):
+        print('%-8s %-12s %6s %9s %9s %9s %9s' % ('widget', 'phase', 'n', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms'))
+        for (widget, phase), samples in self.samples.items():
+            p50, p90, p99 = np.percentile(samples, [50, 90, 99])
+            print('%-8s %-12s %6i %9.2f %9.2f %9.2f %9.2f' % (widget, phase, len(samples), p50, p90, p99, max(samples)))
+        # ru_maxrss is in kilobytes on Linux
+        print('peak RSS: %.1f MB' % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.))
+
+
+def ingest(provider, cycle, unchanged):
+    # what arriving data costs: building the result, its version hash and
+    # its normalized forecast
+    data = canned[provider](0 if unchanged else cycle)
+    location = {'weather': smartmirror.weather_region, 'surf': smartmirror.surf_region,
+                'wind': smartmirror.wind_locations[0], 'news': smartmirror.news_country_code}[provider]
+    result = smartmirror.ProviderResult(provider, location, data)
+    if provider in smartmirror.forecast_normalizers:
+        result.forecast
+    return result
+
+
+def start_xvfb():
+    if os.environ.get('DISPLAY') or shutil.which('Xvfb') is None:
+        return None
+    xvfb = subprocess.Popen(['Xvfb', ':99', '-screen', '0', '1280x1024x24', '-nolisten', 'tcp'],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    os.environ['DISPLAY'] = ':99'
+    time.sleep(1)
+    return xvfb
+
+
+def run_offscreen(args, timings):
+    panels = {'weather': (smartmirror.draw_weather_forecast,
+                          'Temperature Forecast [%s]' % smartmirror.display_unit('degC')),
+              'surf': (smartmirror.draw_surf_forecast, 'Surf Forecast [%s]' % smartmirror.display_unit('ft')),
+              'wind': (smartmirror.draw_wind_forecast, 'Wind Forecast [%s]' % smartmirror.display_unit('mph'))}
+    for name, (draw, title) in panels.items():
+        plot = timings.time(name, 'construct', lambda: OffscreenPlot(None, title, name=name))
+        version = None
+        for cycle in range(args.cycles):
+            result = timings.time(name, 'ingest', ingest, name, cycle, args.unchanged)
+            if result.version == version:
+                continue
+            version = result.version
+            timings.time(name, 'redraw', draw, plot, result.forecast)
+            timings.time(name, 'canvas.draw', plot.canvas.draw)
+
+
+def run_tk(args, timings):
+    root = smartmirror.Tk()
+    root.configure(background='black')
+    smartmirror.image_cache.preload([smartmirror.news_icon], smartmirror.news_icon_size)
+    scheduler = CannedScheduler()
+
+    panels = {'weather': (smartmirror.Weather, 'weather_received'),
+              'surf': (smartmirror.Surf, 'UpdateForecastPlot'),
+              'wind': (smartmirror.Wind, 'ForecastReceived'),
+              'news': (smartmirror.News, 'update_headlines')}
+    for name, (panel_class, update) in panels.items():
+        panel = timings.time(name, 'construct', panel_class, root, scheduler)
+        panel.pack()
+        for cycle in range(args.cycles):
+            result = timings.time(name, 'ingest', ingest, name, cycle, args.unchanged)
+            timings.time(name, 'redraw', getattr(panel, update), result)
+            plot = getattr(panel, 'plot', None)
+            if isinstance(plot, smartmirror.ForecastPlot):
+                timings.time(name, 'canvas.draw', plot.canvas.draw)
+            timings.time(name, 'layout', root.update_idletasks)
+        panel.destroy()
+
+    clock = timings.time('clock', 'construct', smartmirror.Clock, root)
+    clock.pack()
+    for cycle in range(args.cycles):
+        timings.time('clock', 'tick', clock.tick)
+    root.destroy()
+
+
+def record_canned(path, count=24):
+    # captures of canned data for every feed the mirror shows
+    recorder = smartmirror.Recorder(path)
+    feeds = ([('weather', smartmirror.weather_region), ('surf', smartmirror.surf_region), ('news', smartmirror.news_country_code)] +
+             [('wind', location) for location in smartmirror.wind_locations])
+    for provider, location in feeds:
+        for cycle in range(count):
+            recorder.save(provider, location, float(rng.uniform(0.2, 2.)), canned[provider](cycle))
+
+
+def histogram_totals(name):
+    # (count, sum, bucket counts) of a histogram, over all its labels
+    with smartmirror.metrics.lock:
+        histograms = [h for (key, _), h in smartmirror.metrics.histograms.items() if key == name]
+        return (sum(h.count for h in histograms), sum(h.sum for h in histograms),
+                np.sum([h.counts for h in histograms], axis=0) if histograms else np.zeros(len(smartmirror.Histogram.buckets) + 1))
+
+
+def bucket_percentile(counts, q):
+    # upper bound of the bucket holding the q-th percentile
+    if not counts.sum():
+        return 0.
+    idx = np.searchsorted(np.cumsum(counts), counts.sum() * q / 100.)
+    bounds = smartmirror.Histogram.buckets + (float('inf'),)
+    return bounds[min(idx, len(bounds) - 1)]
+
+
+class SoakReport:
+    def __init__(self, root, interval):
+        self.root = root
+        self.interval = interval
+        self.start = time.monotonic()
+        self.last = self.totals()
+        print('%8s %10s %10s %10s %11s %11s %9s' % ('real s', 'sim hours', 'fetch/min', 'draw/min',
+                                                    'lag avg ms', 'lag p99 ms', 'RSS MB'))
+        self.root.after(int(interval * 1000), self.sample)
+
+    def totals(self):
+        return (histogram_totals('smartmirror_fetch_seconds'), histogram_totals('smartmirror_plot_update_seconds'),
+                histogram_totals('smartmirror_loop_lag_seconds'))
+
+    def sample(self):
+        totals = self.totals()
+        (fetches, _, _), (draws, _, _), (lags, lag_sum, lag_counts) = [
+            (now[0] - before[0], now[1] - before[1], now[2] - before[2]) for now, before in zip(totals, self.last)]
+        self.last = totals
+        elapsed = time.monotonic() - self.start
+        minutes = self.interval / 60.
+        print('%8.0f %10.1f %10.1f %10.1f %11.1f %11.0f %9.1f' % (
+            elapsed, elapsed * smartmirror.time_scale / 3600., fetches / minutes, draws / minutes,
+            1000. * lag_sum / lags if lags else 0., 1000. * bucket_percentile(lag_counts, 99),
+            smartmirror.rss_bytes() / 2.**20))
+        self.root.after(int(self.interval * 1000), self.sample)
+
+
+def run_soak(args):
+    workdir = tempfile.mkdtemp(prefix='smartmirror-soak-')
+    if args.replay is None:
+        args.replay = os.path.join(workdir, 'captures')
+        record_canned(args.replay)
+    # keep the soak away from the real snapshots and history
+    smartmirror.snapshot_dir = os.path.join(workdir, 'snapshots')
+    smartmirror.history_dir = os.path.join(workdir, 'history')
+    smartmirror.replay_dir = args.replay
+    smartmirror.replay_latency = args.latency
+    smartmirror.replay_jitter = args.jitter
+    smartmirror.replay_failure_rate = args.failure_rate
+    smartmirror.time_scale = args.time_scale
+    smartmirror.metrics_address = None
+    smartmirror.hub_url = None
+
+    window = smartmirror.FullscreenWindow()
+    SoakReport(window.tk, args.sample)
+    window.tk.after(int(args.soak * 60 * 1000), window.tk.quit)
+    window.tk.mainloop()
+    window.scheduler.close()
+    window.source.close()
+    print(window.source.cache.report())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the mirror panels against canned data.')
+    parser.add_argument('--cycles', type=int, default=100, help='refresh cycles per panel')
+    parser.add_argument('--unchanged', action='store_true', help='feed identical data every cycle')
+    parser.add_argument('--offscreen', action='store_true', help='only benchmark the plots, on Agg')
+    parser.add_argument('--renderer', choices=sorted(smartmirror.plot_classes), default='matplotlib',
+                        help='plot renderer of every forecast panel')
+    parser.add_argument('--soak', type=float, metavar='MINUTES', help='soak test the whole window on replayed data')
+    parser.add_argument('--replay', metavar='DIR', help='captures to replay (default: canned data)')
+    parser.add_argument('--time-scale', type=float, default=100, help='soak this many times faster than real time')
+    parser.add_argument('--latency', type=float, help='replay latency in seconds (default: as recorded)')
+    parser.add_argument('--jitter', type=float, default=0.2, help='replay latency jitter, as a fraction')
+    parser.add_argument('--failure-rate', type=float, default=0., help='fraction of replayed fetches that fail')
+    parser.add_argument('--sample', type=float, default=30, help='seconds between soak reports')
+    args = parser.parse_args()
+    if args.offscreen and args.renderer != 'matplotlib':
+        parser.error('--offscreen only benchmarks matplotlib plots')
+    smartmirror.plot_renderers = dict.fromkeys(smartmirror.plot_renderers, args.renderer)
+
+    timings = Timings()
+    xvfb = None if args.offscreen else start_xvfb()
+    try:
+        if args.soak:
+            if not os.environ.get('DISPLAY'):
+                print('Soak tests need a display or Xvfb')
+                return 1
+            run_soak(args)
+            return 0
+        if args.offscreen or not os.environ.get('DISPLAY'):
+            if args.renderer != 'matplotlib':
+                print('The %s renderer needs a display or Xvfb' % args.renderer)
+                return 1
+            print('Benchmarking plots offscreen on Agg')
+            run_offscreen(args, timings)
+        else:
+            run_tk(args, timings)
+    finally:
+        if xvfb is not None:
+            xvfb.terminate()
+    timings.report()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
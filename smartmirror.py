@@ -6,24 +6,35 @@ from tkinter import *
 import locale
 import threading
 import time
-import requests
 import json
 import traceback
-import feedparser
-import numpy as np
 import os
+import queue
+import hashlib
+import random
+import re
+import gzip
+import pickle
+import importlib
+import sys
+import bisect
+import http.server
+import gc
+import tracemalloc
+import weakref
+import heapq
+import urllib.parse
+
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import Future, ThreadPoolExecutor
 
-from PIL import Image, ImageTk
 from contextlib import contextmanager
 
-import matplotlib
-matplotlib.use("TkAgg")
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-
-from GoogleWeather.GoogleWeather import GoogleWeatherAPI
-from SurflineScraper.SurflineScraper import SurflineScraper
-from iWindsurfScraper.iWindsurfScraper import iWindsurfScraper
+# Heavy modules (numpy, matplotlib, PIL, requests, feedparser, and pandas
+# through the scrapers) are imported where they are first used. At startup
+# they are loaded on a background thread while the window and clock are
+# already up; see panel_modules and FullscreenWindow.
 
 LOCALE_LOCK = threading.Lock()
 
@@ -31,15 +42,169 @@ ui_locale = '' # e.g. 'fr_FR' fro French, '' as default
 time_format = 12 # 12 or 24
 date_format = "%b %d, %Y" # check python doc for strftime() for options
 news_country_code = 'us'
+news_headline_count = 5
 weather_region = 'Redwood City'
 surf_region = 'OCEAN_BEACH_OVERVIEW'
 # wind_locations = ['3Rd AVE CHANNEL', 'Anita Rock-Crissy Field', 'Palo Alto', 'Coyote Point']
 wind_locations = ['3RD AVE CHANNEL']
+wind_small_multiples = False  # True shows every wind location at once
+# .ics files for the calendar panel, local or kept in sync by another tool
+# (e.g. ['~/calendars/home.ics']); the panel is left out while this is empty
+calendar_paths = []
+calendar_event_count = 5
 xlarge_text_size = 50
 large_text_size = 48
 medium_text_size = 28
 small_text_size = 12
 
+# how each forecast panel draws its plot: 'matplotlib' (full featured) or
+# 'spark' (plain lines on a Tk canvas, without loading matplotlib at all)
+plot_renderers = {'weather': 'matplotlib', 'surf': 'matplotlib', 'wind': 'matplotlib'}
+# units the forecast plots show instead of the providers' own (degC, ft,
+# mph), e.g. {'degC': 'degF', 'ft': 'm', 'mph': 'kn'}
+display_units = {}
+# longer forecasts are averaged into whole-hour buckets down to about this
+# many points before they are plotted
+plot_max_points = 120
+
+# modules each panel needs, imported off the Tk thread before it is built
+panel_modules = {
+    'weather': ['numpy', 'PIL.ImageTk', 'matplotlib', 'matplotlib.figure',
+                'matplotlib.backends.backend_tkagg', 'GoogleWeather.GoogleWeather'],
+    'surf': ['numpy', 'matplotlib', 'matplotlib.figure', 'matplotlib.backends.backend_tkagg',
+             'pandas', 'SurflineScraper.SurflineScraper'],
+    'wind': ['numpy', 'matplotlib', 'matplotlib.figure', 'matplotlib.backends.backend_tkagg',
+             'pandas', 'iWindsurfScraper.iWindsurfScraper'],
+    'news': ['PIL.ImageTk', 'requests', 'feedparser'],
+    'calendar': ['dateutil.rrule'],
+}
+
+# Prometheus text metrics are served on metrics_address ('0.0.0.0' lets a
+# fleet dashboard on the LAN scrape them; None turns the endpoint off) and
+# printed every metrics_log_interval seconds if that is set
+metrics_address = ('127.0.0.1', 9101)
+metrics_log_interval = None
+loop_lag_interval = 1
+
+# seconds a provider fetch may run before its result is abandoned
+fetch_timeouts = {'weather': 30, 'surf': 60, 'wind': 60, 'news': 30, 'calendar': 30}
+fetch_workers = 8
+
+# Providers whose scraper runs in its own worker process instead of on the
+# fetch pool, e.g. ['surf', 'wind'], so a slow parse never holds the GIL of
+# the Tk loop and a crash only takes down the worker. A worker that runs
+# past the provider's fetch timeout, or dies, is killed and restarted.
+# Each provider gets up to isolated_workers processes, started as concurrent
+# fetches need them; keep it at least the number of locations (a fetch
+# waiting for a free worker is still on the clock of its fetch timeout).
+isolated_providers = []
+isolated_workers = 4
+
+# How often each provider is refreshed, in seconds. A refresh that brings
+# back unchanged data, or fails, multiplies the next delay by 'backoff' up to
+# 'max_interval'; new data resets it to 'interval'. Within publish_window of
+# one of the 'publish_times' (local HH:MM) the delay drops to 'min_interval'.
+# Every delay gets +/- 'jitter' (a fraction) so mirrors don't sync up.
+refresh_policies = {
+    'weather': {'interval': 600, 'min_interval': 300, 'max_interval': 3600,
+                'backoff': 2, 'jitter': 0.1, 'publish_times': []},
+    'surf': {'interval': 1800, 'min_interval': 600, 'max_interval': 10800,
+             'backoff': 2, 'jitter': 0.1, 'publish_times': ['04:00', '10:00', '16:00', '22:00']},
+    'wind': {'interval': 900, 'min_interval': 300, 'max_interval': 3600,
+             'backoff': 1.5, 'jitter': 0.1, 'publish_times': []},
+    'news': {'interval': 600, 'min_interval': 300, 'max_interval': 3600,
+             'backoff': 1.5, 'jitter': 0.1, 'publish_times': []},
+    'calendar': {'interval': 300, 'min_interval': 300, 'max_interval': 300,
+                 'backoff': 1, 'jitter': 0, 'publish_times': []},
+}
+publish_window = 900
+wind_rotate_interval = 200
+
+# seconds each provider's data is served from cache before going upstream
+# again; keep these below the min_interval of refresh_policies
+cache_ttls = {'weather': 120, 'surf': 300, 'wind': 120, 'news': 120, 'calendar': 0}
+cache_max_entries = 32
+
+# shared keep-alive HTTP session used for the news feed
+http_pool_size = 4
+http_timeout = 20
+
+# last good payload of every provider is kept here for warm starts / offline use
+snapshot_dir = 'snapshots'
+# seconds after which a panel shows how old its data is
+stale_after = {'weather': 1800, 'surf': 3600, 'wind': 1800, 'news': 3600}
+
+# History of temperatures, surf heights and wind speeds, kept in history_dir.
+# Each tier is (bucket seconds, retention seconds): points older than a
+# tier's retention are averaged into the buckets of the next tier, and the
+# last tier drops them. Besides the forecast for now, the forecast for
+# now + each of history_leads hours is kept, to check forecasts against.
+# Points are written at most every history_flush_interval seconds.
+history_dir = 'history'
+history_tiers = [(0, 2 * 86400), (3600, 60 * 86400), (86400, 5 * 365 * 86400)]
+history_leads = (24, 48)
+history_flush_interval = 900
+history_trend_tolerance = 3 * 3600  # how far from 24h ago "yesterday" may be
+
+# Long-uptime memory guard, checked every memory_check_interval seconds.
+# Going over a budget reclaims memory: the data cache is trimmed, unused icons
+# are dropped, stray pyplot figures are closed, and over rss_bytes every
+# forecast figure is rebuilt from scratch (again only once RSS has grown by
+# memory_rebuild_growth, since freed memory rarely goes back to the OS).
+# tracemalloc is slow and heavy, so it only runs with memory_trace_frames > 0
+# (that many frames per allocation, from startup) or, with
+# memory_trace_over_budget, from the first time a budget is exceeded. Each
+# check then prints, from a background thread, the memory_growth_sites lines
+# whose allocations grew the most.
+memory_check_interval = 600
+memory_budgets = {'rss_bytes': 400 * 2**20, 'tk_images': 64, 'figures': 12, 'cache_bytes': 32 * 2**20}
+memory_rebuild_growth = 32 * 2**20
+memory_trace_frames = 0
+memory_trace_over_budget = True
+memory_growth_sites = 10
+
+# Hub mode: `python smartmirror.py --hub` does all the fetching once and
+# publishes the results on hub_address. Other mirrors set hub_url (e.g.
+# 'http://mirror-hub.local:9102') to subscribe to it instead of going
+# upstream themselves. The hub serves the regions in its own config, so
+# its subscribers should be set up with the same ones.
+hub_address = ('0.0.0.0', 9102)
+hub_url = None
+hub_poll_wait = 30  # seconds the hub holds an update request open
+hub_retry = (5, 300)  # first and longest wait after losing the hub
+
+# Idle mode. The mirror goes idle while the display is off according to DPMS
+# (`xset q`, if idle_dpms is set); otherwise, with a presence_file (touched
+# by e.g. a motion sensor script), once it is older than presence_timeout
+# seconds; otherwise between the local 'HH:MM' times of idle_hours. While
+# idle, panel updates wait and idle_paused_providers stop refreshing; on
+# wake they are fetched again and every panel redraws once with the latest.
+idle_hours = None  # e.g. ('23:30', '06:30')
+presence_file = None
+presence_timeout = 600
+idle_dpms = False
+idle_check_interval = 30
+idle_hub_poll_ms = 5000  # how often a hub-fed mirror picks up updates while idle
+idle_paused_providers = ('surf', 'wind', 'news')
+# seconds of panel updates per event-loop turn; the rest wait for the next
+frame_budget = 0.03
+frame_gap_ms = 10
+
+# Record / replay of provider responses, for reproducing problems offline
+# and soak testing (see benchmark.py --soak). With record_dir set, every
+# fetch is also saved there with how long it took. With replay_dir set,
+# providers are served from such captures instead, taking the recorded
+# time (or replay_latency seconds) +/- replay_jitter (a fraction), and
+# failing replay_failure_rate of the time.
+record_dir = None
+replay_dir = None
+replay_latency = None
+replay_jitter = 0.2
+replay_failure_rate = 0.
+# every refresh, rotation, cache TTL and housekeeping interval is divided by
+# time_scale, so a soak test covers days of uptime in minutes
+time_scale = 1
+
 # FRAME_DEBUG = {'highlightbackground': "white",
 #                'highlightthickness': 1}
 
@@ -47,6 +212,10 @@ FRAME_DEBUG = {'highlightbackground': None,
                'highlightthickness': 0}
 
 
+def scaled(seconds):
+    return seconds / time_scale
+
+
 @contextmanager
 def setlocale(name): #thread proof function to work with locale
     with LOCALE_LOCK:
@@ -56,6 +225,283 @@ def setlocale(name): #thread proof function to work with locale
         finally:
             locale.setlocale(locale.LC_ALL, saved)
 
+startup_start = time.perf_counter()
+startup_timings = []  # (label, seconds since start, seconds taken)
+
+
+@contextmanager
+def startup_timer(label):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings.append((label, start - startup_start, time.perf_counter() - start))
+
+
+def import_modules(names):
+    # safe to call from any thread; already imported modules cost nothing
+    for name in names:
+        if name not in sys.modules:
+            with startup_timer('import %s' % name):
+                module = importlib.import_module(name)
+            if name == 'matplotlib':
+                # before any scraper gets to pull in pyplot
+                module.use("TkAgg")
+
+
+def startup_report():
+    lines = ['Startup timing (start / took, seconds):']
+    for label, started, took in sorted(startup_timings, key=lambda timing: timing[1]):
+        lines.append('  %7.3f  %7.3f  %s' % (started, took, label))
+    return '\n'.join(lines)
+
+
+class Histogram:
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def format_labels(labels, **extra):
+    labels = dict(labels, **extra)
+    if not labels:
+        return ''
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{%s}' % ','.join('%s="%s"' % (name, escape(value)) for name, value in sorted(labels.items()))
+
+
+class Metrics:
+    # In-process histograms and counters, rendered in the Prometheus text
+    # format for the metrics endpoint and the periodic log dump.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def gauge(self, name, func):
+        # func() returns [(labels dict, value), ...] when metrics are rendered
+        self.gauges[name] = func
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            histograms = sorted((key, list(h.counts), h.sum, h.count) for key, h in self.histograms.items())
+            counters = sorted(self.counters.items())
+        typed = set()
+        for (name, labels), counts, total, count in histograms:
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE %s histogram' % name)
+            cumulative = 0
+            for bound, bucket in zip(Histogram.buckets + ('+Inf',), counts):
+                cumulative += bucket
+                lines.append('%s_bucket%s %i' % (name, format_labels(labels, le=bound), cumulative))
+            lines.append('%s_sum%s %f' % (name, format_labels(labels), total))
+            lines.append('%s_count%s %i' % (name, format_labels(labels), count))
+        for (name, labels), value in counters:
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE %s counter' % name)
+            lines.append('%s%s %s' % (name, format_labels(labels), value))
+        for name, func in sorted(self.gauges.items()):
+            lines.append('# TYPE %s gauge' % name)
+            for labels, value in func():
+                lines.append('%s%s %s' % (name, format_labels(labels), value))
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = metrics.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_metrics_server(address=None):
+    address = metrics_address if address is None else address
+    if address is None:
+        return None
+    try:
+        server = http.server.ThreadingHTTPServer(address, MetricsHandler)
+    except OSError as e:
+        print("Error: %s. Cannot serve metrics on %s:%s." % (e, address[0], address[1]))
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
+
+
+class LoopLagMonitor:
+    # Measures how late Tk after() callbacks fire, i.e. how long the event
+    # loop was busy with something else. Paused while the mirror is idle.
+
+    def __init__(self, root, interval=loop_lag_interval, render=None):
+        self.root = root
+        self.interval = interval
+        self.render = render
+        self.schedule()
+
+    def schedule(self):
+        self.expected = time.monotonic() + self.interval
+        self.root.after(int(self.interval * 1000), self.probe)
+
+    def probe(self):
+        metrics.observe('smartmirror_loop_lag_seconds', max(0., time.monotonic() - self.expected))
+        if self.render is not None and self.render.idle:
+            self.render.on_wake.append(self.schedule)
+        else:
+            self.schedule()
+
+
+def rss_bytes():
+    # current resident set size; falls back to the peak where /proc is missing
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class MemoryGuard:
+    # Watches what a mirror running for months accumulates (Tk images,
+    # matplotlib figures, cached payloads, the process RSS) against
+    # memory_budgets, reclaims whatever is over, and with tracemalloc on
+    # reports where allocations grew since the previous check.
+
+    def __init__(self, root, source, interval=memory_check_interval):
+        self.root = root
+        self.source = source
+        self.interval = interval
+        self.usage = {}
+        self.snapshot = None  # only touched by the report thread
+        self.reporting = False
+        self.rebuilt_rss = None  # RSS after the last figure rebuild
+        if memory_trace_frames and not tracemalloc.is_tracing():
+            tracemalloc.start(memory_trace_frames)
+        # rendered off the Tk thread, so it only reports the last check
+        metrics.gauge('smartmirror_memory', lambda: [({'kind': kind}, value)
+                                                      for kind, value in sorted(self.usage.items())])
+        root.after(int(scaled(interval) * 1000), self.check)
+
+    def figure_count(self):
+        count = len(ForecastPlot.live)
+        if 'matplotlib.pyplot' in sys.modules:
+            # scrapers that plot through pyplot leave figures in its registry
+            count += len(sys.modules['matplotlib.pyplot'].get_fignums())
+        return count
+
+    def measure(self):
+        return {'rss_bytes': rss_bytes(),
+                'tk_images': len(self.root.tk.splitlist(self.root.tk.call('image', 'names'))),
+                'figures': self.figure_count(),
+                'cache_bytes': self.source.cache.payload_bytes()}
+
+    def check(self):
+        try:
+            self.usage = usage = self.measure()
+            print('Memory: %s' % ', '.join('%s %i' % item for item in sorted(usage.items())))
+            over = [kind for kind, budget in sorted(memory_budgets.items()) if usage.get(kind, 0) > budget]
+            if over and memory_trace_over_budget and not tracemalloc.is_tracing():
+                print('Tracing allocations from now on')
+                tracemalloc.start(max(memory_trace_frames, 1))
+            if tracemalloc.is_tracing() and not self.reporting:
+                # a snapshot and compare takes seconds, so not on the Tk thread
+                self.reporting = True
+                threading.Thread(target=self.report_growth, daemon=True).start()
+            if over:
+                self.reclaim(over)
+        except Exception as e:
+            traceback.print_exc()
+            print("Error: %s. Cannot check memory." % e)
+        self.root.after(int(scaled(self.interval) * 1000), self.check)
+
+    def report_growth(self):
+        try:
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+                tracemalloc.Filter(False, '<unknown>'),
+            ))
+            if self.snapshot is not None:
+                growth = [stat for stat in snapshot.compare_to(self.snapshot, 'lineno') if stat.size_diff > 0]
+                if growth:
+                    print('Top memory growth since the last check:')
+                    for stat in growth[:memory_growth_sites]:
+                        print('  %s' % stat)
+            self.snapshot = snapshot
+        except Exception as e:
+            print("Error: %s. Cannot report memory growth." % e)
+        finally:
+            self.reporting = False
+
+    def reclaim(self, over):
+        print('Over memory budget for %s, reclaiming' % ', '.join(over))
+        metrics.increment('smartmirror_memory_reclaims_total')
+        if 'cache_bytes' in over:
+            evicted = self.source.cache.trim(memory_budgets['cache_bytes'])
+            print('Evicted %i cache entries' % evicted)
+        if 'tk_images' in over:
+            image_cache.clear()
+        if 'figures' in over and 'matplotlib.pyplot' in sys.modules:
+            sys.modules['matplotlib.pyplot'].close('all')
+        rebuild = 'rss_bytes' in over and (
+            self.rebuilt_rss is None or self.usage['rss_bytes'] > self.rebuilt_rss + memory_rebuild_growth)
+        if rebuild:
+            for plot in list(ForecastPlot.live):
+                plot.rebuild()
+            image_cache.clear()
+        elif 'rss_bytes' in over:
+            print('RSS has not grown since the last rebuild, leaving the figures')
+        gc.collect()
+        if rebuild:
+            self.rebuilt_rss = rss_bytes()
+
+
 # maps open weather icons to
 # icon reading is not impacted by the 'lang' parameter
 icon_lookup = {
@@ -70,14 +516,2186 @@ icon_lookup = {
     'clear-night': "assets/Moon.png",  # clear sky night
     'partly-cloudy-night': "assets/PartlyMoon.png",  # scattered clouds night
     'thunderstorm': "assets/Storm.png",  # thunderstorm
-    'tornado': "assests/Tornado.png",    # tornado
-    'hail': "assests/Hail.png"  # hail
+    'tornado': "assets/Tornado.png",    # tornado
+    'hail': "assets/Hail.png"  # hail
+}
+news_icon = "assets/Newspaper.png"
+weather_icon_size = (30, 30)
+news_icon_size = (25, 25)
+
+
+class ImageCache:
+    # Decodes each asset once and keeps one PhotoImage per (path, size), so
+    # every label showing the same icon shares a single Tk image instead of
+    # re-reading and re-resizing it on every refresh.
+
+    def __init__(self):
+        self.sources = {}
+        self.photos = {}
+
+    def get(self, path, size):
+        photo = self.photos.get((path, size))
+        if photo is None:
+            image = self.sources.get(path)
+            if image is None:
+                from PIL import Image
+                image = self.sources[path] = Image.open(path)
+                image.load()
+            from PIL import Image, ImageTk
+            image = image.resize(size, Image.LANCZOS).convert('RGB')
+            photo = self.photos[(path, size)] = ImageTk.PhotoImage(image)
+        return photo
+
+    def clear(self):
+        # Tk images still shown by a label live on through the label's reference
+        self.sources.clear()
+        self.photos.clear()
+
+    def preload(self, paths, size):
+        for path in paths:
+            try:
+                self.get(path, size)
+            except Exception as e:
+                print("Error: %s. Cannot load %s." % (e, path))
+
+
+def validate_icons():
+    # report broken icon_lookup entries up front rather than on first use
+    missing = sorted(set(path for path in icon_lookup.values() if not os.path.isfile(path)))
+    for path in missing:
+        print('Warning: icon %s does not exist' % path)
+    return missing
+
+
+image_cache = ImageCache()
+
+
+def content_hash(data):
+    # Digest of a provider payload. It is worked out once when the data
+    # arrives, and panels compare it instead of the data itself.
+    import numpy as np
+    digest = hashlib.blake2b(digest_size=16)
+    if hasattr(data, 'columns') and hasattr(data, 'index'):
+        import pandas
+        digest.update(repr(list(data.columns)).encode())
+        digest.update(pandas.util.hash_pandas_object(data, index=True).values.tobytes())
+    elif isinstance(data, np.ndarray):
+        digest.update(repr((data.dtype.descr, data.shape)).encode())
+        digest.update(np.ascontiguousarray(data).tobytes())
+    else:
+        digest.update(json.dumps(data, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def payload_size(data):
+    # rough bytes held by a provider payload
+    if hasattr(data, 'memory_usage'):
+        return int(data.memory_usage(index=True, deep=True).sum())
+    if hasattr(data, 'nbytes'):
+        return int(data.nbytes)
+    try:
+        return len(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return sys.getsizeof(data)
+
+
+# vectorized unit conversions: (from, to) -> function of an array
+unit_conversions = {
+    ('degC', 'degF'): lambda values: values * 9. / 5. + 32,
+    ('degF', 'degC'): lambda values: (values - 32) * 5. / 9.,
+    ('ft', 'm'): lambda values: values * 0.3048,
+    ('m', 'ft'): lambda values: values / 0.3048,
+    ('mph', 'kn'): lambda values: values * 0.868976,
+    ('kn', 'mph'): lambda values: values / 0.868976,
+    ('mph', 'km/h'): lambda values: values * 1.609344,
+    ('km/h', 'mph'): lambda values: values / 1.609344,
+}
+
+
+def convert_units(values, unit, to):
+    if unit == to:
+        return values
+    return unit_conversions[(unit, to)](values)
+
+
+def local_times(times):
+    # datetime64[s] local wall-clock times; tz-aware ones are converted
+    import numpy as np
+    import pandas as pd
+    index = pd.DatetimeIndex(times)
+    if index.tz is not None:
+        index = index.tz_convert(None) + pd.Timedelta(seconds=time.localtime().tm_gmtoff)
+    return np.asarray(index, dtype='datetime64[s]')
+
+
+class Forecast:
+    # A provider's forecast normalized into one NumPy structured array: a
+    # 'time' field (local wall-clock datetime64[s], NaT when the provider
+    # gave none) and a float64 field per quantity. units maps each field to
+    # its unit; labels optionally names each row (weather's day names).
+
+    def __init__(self, values, units, labels=None):
+        self.values = values
+        self.units = units
+        self.labels = labels
+
+    @classmethod
+    def build(cls, times, fields, units, labels=None):
+        import numpy as np
+        values = np.empty(len(times), [('time', 'datetime64[s]')] + [(name, 'f8') for name in fields])
+        values['time'] = times
+        for name, column in fields.items():
+            values[name] = column
+        return cls(values, units, labels)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, field):
+        return self.values[field]
+
+    @property
+    def fields(self):
+        return self.values.dtype.names[1:]
+
+    @property
+    def times(self):
+        return self.values['time']
+
+    @property
+    def timed(self):
+        import numpy as np
+        return len(self.values) > 0 and not np.isnat(self.values['time']).any()
+
+    def epoch(self):
+        # times as UTC seconds since the epoch
+        return self.values['time'].astype('int64') - float(time.localtime().tm_gmtoff)
+
+    def to(self, **units):
+        # copy with the given fields converted, e.g. forecast.to(max='degF')
+        units = dict((field, unit) for field, unit in units.items() if self.units[field] != unit)
+        if not units:
+            return self
+        values = self.values.copy()
+        for field, unit in units.items():
+            values[field] = convert_units(values[field], self.units[field], unit)
+        return Forecast(values, dict(self.units, **units), self.labels)
+
+    def resample(self, seconds):
+        # mean of every field over consecutive buckets of the given length
+        import numpy as np
+        buckets = self.values['time'].astype('int64') // seconds * seconds
+        starts, first, inverse = np.unique(buckets, return_index=True, return_inverse=True)
+        values = np.empty(len(starts), self.values.dtype)
+        values['time'] = starts.astype('datetime64[s]')
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for field in self.fields:
+                finite = np.isfinite(self.values[field])
+                values[field] = (np.bincount(inverse, weights=np.where(finite, self.values[field], 0)) /
+                                 np.bincount(inverse, weights=finite))
+        labels = None if self.labels is None else self.labels[first]
+        return Forecast(values, self.units, labels)
+
+
+def display_unit(unit):
+    return display_units.get(unit, unit)
+
+
+def plot_forecast(forecast):
+    # the forecast as the plots show it: in display_units, at most about
+    # plot_max_points rows
+    import numpy as np
+    forecast = forecast.to(**dict((field, display_unit(unit)) for field, unit in forecast.units.items()))
+    if forecast.timed and len(forecast) > plot_max_points:
+        span = int((forecast.times[-1] - forecast.times[0]) / np.timedelta64(1, 's'))
+        hours = -(-span // (3600 * plot_max_points))
+        forecast = forecast.resample(max(hours, 1) * 3600)
+    return forecast
+
+
+def forecast_from_frame(frame, fields, units):
+    # fields maps Forecast field names to DataFrame columns
+    import numpy as np
+    times = time_axis(frame)
+    times = np.full(len(frame), 'NaT', 'datetime64[s]') if times is None else local_times(times)
+    return Forecast.build(times, dict((name, frame[column].to_numpy(dtype=float))
+                                      for name, column in fields.items()), units)
+
+
+def forecast_from_days(days):
+    # daily forecast starting today, from the weather provider's next_days
+    import numpy as np
+    temps = np.array([(day['min_temp_c'], day['max_temp_c']) for day in days], dtype=float).reshape(-1, 2)
+    times = np.datetime64(time.strftime('%Y-%m-%d'), 's') + np.arange(len(days)) * np.timedelta64(1, 'D')
+    return Forecast.build(times, {'min': temps[:, 0], 'max': temps[:, 1], 'mean': temps.mean(axis=1)},
+                          dict.fromkeys(('min', 'max', 'mean'), 'degC'),
+                          labels=np.array([day['name'] for day in days], dtype=object))
+
+
+# provider payload -> Forecast
+forecast_normalizers = {
+    'weather': lambda data: forecast_from_days(data['next_days']),
+    'surf': lambda data: forecast_from_frame(data, {'height': 'Wave Avg Height [ft]'}, {'height': 'ft'}),
+    'wind': lambda data: forecast_from_frame(data, {'speed': 'Wind Speed [mph]'}, {'speed': 'mph'}),
+}
+
+
+class ProviderResult:
+    def __init__(self, provider, location, data, fetched_at=None, version=None):
+        self.provider = provider
+        self.location = location
+        self.data = data
+        self.fetched_at = time.time() if fetched_at is None else fetched_at
+        self.version = content_hash(data) if version is None else version
+        self.normalized = None
+
+    @property
+    def forecast(self):
+        # the data as a Forecast, worked out once on first use
+        if self.normalized is None:
+            self.normalized = forecast_normalizers[self.provider](self.data)
+        return self.normalized
+
+    @property
+    def age(self):
+        return time.time() - self.fetched_at
+
+
+def format_age(seconds):
+    if seconds < 3600:
+        return '%i min ago' % (seconds // 60)
+    if seconds < 86400:
+        return '%i h ago' % (seconds // 3600)
+    return '%i days ago' % (seconds // 86400)
+
+
+def safe_name(provider, location):
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', '%s-%s' % (provider, location))
+
+
+class SnapshotStore:
+    # Keeps the last good result of every (provider, location) on disk as a
+    # gzipped pickle, so the mirror can draw right away on boot and keep
+    # showing something when the network is down.
+
+    def __init__(self, path=None):
+        self.path = snapshot_dir if path is None else path
+        os.makedirs(self.path, exist_ok=True)
+
+    def _file(self, provider, location):
+        return os.path.join(self.path, safe_name(provider, location) + '.pkl.gz')
+
+    def load(self, provider, location):
+        try:
+            with gzip.open(self._file(provider, location), 'rb') as f:
+                data, fetched_at, version = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print("Error: %s. Ignoring snapshot for %s %s." % (e, provider, location))
+            return None
+        return ProviderResult(provider, location, data, fetched_at, version)
+
+    def save(self, result):
+        path = self._file(result.provider, result.location)
+        tmp = '%s.%i.tmp' % (path, threading.get_ident())
+        try:
+            with gzip.open(tmp, 'wb', compresslevel=6) as f:
+                pickle.dump((result.data, result.fetched_at, result.version), f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except Exception as e:
+            print("Error: %s. Cannot save snapshot for %s %s." % (e, result.provider, result.location))
+
+
+history_dtype = [('t', '<f8'), ('v', '<f4')]  # seconds since the epoch, value
+history_series = {'surf': ('surf.height', 'height'), 'wind': ('wind.speed', 'speed')}  # series, Forecast field
+history_units = {'surf.height': 'ft', 'wind.speed': 'mph', 'weather.temp': u'\N{DEGREE SIGN}C'}
+
+
+def history_points(result, leads=history_leads):
+    # (series, time, value) to keep from a provider result: what it says
+    # for now as '<name>/<location>', and what it says for now + lead hours
+    # as '<name>@<lead>h/<location>', stamped with the time it is for
+    import numpy as np
+    now = result.fetched_at
+    if result.provider == 'weather':
+        return [('weather.temp/%s' % result.location, now, float(result.data['temp_c']))]
+    name, field = history_series.get(result.provider, (None, None))
+    if name is None:
+        return []
+    forecast = result.forecast
+    if len(forecast) < 2 or not forecast.timed:
+        return []
+    targets = now + np.r_[0, leads] * 3600.
+    values = np.interp(targets, forecast.epoch(), forecast[field], left=np.nan, right=np.nan)
+    names = [name] + ['%s@%ih' % (name, lead) for lead in leads]
+    return [('%s/%s' % (series, result.location), target, value)
+            for series, target, value in zip(names, targets, values) if np.isfinite(value)]
+
+
+class TimeSeriesStore:
+    # Append-only history of numeric series. Every series has one file per
+    # tier of packed (time, value) records, read through np.memmap, so a
+    # range query is two binary searches and a slice. Points are batched in
+    # memory and appended at most every flush_interval seconds to spare the
+    # SD card; old points get averaged into coarser tiers as they age. The
+    # day-over-day trend of a series is worked out when it is recorded, on
+    # the fetch thread, so panels only look it up.
+
+    def __init__(self, path=None, tiers=None, flush_interval=None):
+        self.path = history_dir if path is None else path
+        self.tiers = history_tiers if tiers is None else tiers
+        self.flush_interval = history_flush_interval if flush_interval is None else flush_interval
+        self.pending = {}  # series -> [(t, v), ...]
+        self.maps = {}  # (series, bucket) -> memmap of the file
+        self.trends = {}  # series -> change since about a day ago
+        self.flushed = time.monotonic()
+        self.lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+
+    def _file(self, series, bucket):
+        return os.path.join(self.path, '%s.%i.ts' % (urllib.parse.quote(series, safe=''), bucket))
+
+    def series(self):
+        names = set(urllib.parse.unquote(name.rsplit('.', 2)[0])
+                    for name in os.listdir(self.path) if name.endswith('.ts'))
+        return sorted(names | set(self.pending))
+
+    def _read(self, series, bucket):
+        import numpy as np
+        data = self.maps.get((series, bucket))
+        if data is None:
+            path = self._file(series, bucket)
+            if not os.path.exists(path) or os.path.getsize(path) < np.dtype(history_dtype).itemsize:
+                return np.empty(0, history_dtype)
+            data = self.maps[(series, bucket)] = np.memmap(path, history_dtype, mode='r')
+        return data
+
+    def _write(self, series, bucket, records, append=True):
+        self.maps.pop((series, bucket), None)
+        path = self._file(series, bucket)
+        if append:
+            with open(path, 'ab') as f:
+                f.write(records.tobytes())
+            return
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(records.tobytes())
+        os.replace(tmp, path)
+
+    def record(self, series, t, value):
+        with self.lock:
+            self.pending.setdefault(series, []).append((t, value))
+            due = time.monotonic() - self.flushed > scaled(self.flush_interval)
+        if due:
+            self.flush()
+
+    def record_result(self, result):
+        recorded = set()
+        for series, t, value in history_points(result):
+            self.record(series, t, value)
+            recorded.add(series)
+        for series in recorded:
+            self.trends[series] = self.trend(series)
+
+    def trend(self, series):
+        # None until there is a point from about a day before the latest
+        latest = self.latest(series)
+        if latest is None:
+            return None
+        before = self.value_near(series, latest[0] - 86400, history_trend_tolerance)
+        return None if before is None else latest[1] - before
+
+    def flush(self, now=None):
+        import numpy as np
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.flushed = time.monotonic()
+            try:
+                for series, points in pending.items():
+                    records = np.array(points, history_dtype)
+                    records = records[np.argsort(records['t'], kind='stable')]
+                    last = self._read(series, 0)
+                    if len(last):
+                        # appends must stay in time order
+                        records = records[records['t'] > last['t'][-1]]
+                    if len(records):
+                        self._write(series, 0, records)
+                for series in self.series():
+                    self._compact(series, time.time() if now is None else now)
+            except Exception as e:
+                print("Error: %s. Cannot write history." % e)
+
+    def _compact(self, series, now):
+        import numpy as np
+        for idx, (bucket, retention) in enumerate(self.tiers):
+            data = self._read(series, bucket)
+            if not len(data) or data['t'][0] >= now - retention:
+                continue
+            if idx + 1 == len(self.tiers):
+                self._write(series, bucket, np.array(data[data['t'] >= now - retention]), append=False)
+                continue
+            # only whole buckets of the next tier move on
+            coarse = self.tiers[idx + 1][0]
+            cutoff = (now - retention) // coarse * coarse
+            old = data[data['t'] < cutoff]
+            if not len(old):
+                continue
+            starts, inverse = np.unique(old['t'] // coarse * coarse, return_inverse=True)
+            merged = np.empty(len(starts), history_dtype)
+            merged['t'] = starts
+            merged['v'] = np.bincount(inverse, weights=old['v']) / np.bincount(inverse)
+            before = self._read(series, coarse)
+            if len(before):
+                merged = merged[merged['t'] > before['t'][-1]]
+            if len(merged):
+                self._write(series, coarse, merged)
+            self._write(series, bucket, np.array(data[data['t'] >= cutoff]), append=False)
+
+    def query(self, series, start=0, end=float('inf')):
+        # (times, values) of series between start and end, oldest first
+        import numpy as np
+        with self.lock:
+            parts = []
+            for bucket, _ in reversed(self.tiers):
+                data = self._read(series, bucket)
+                lo, hi = np.searchsorted(data['t'], [start, end], side='left')
+                parts.append(np.array(data[lo:hi]))
+            pending = np.array(self.pending.get(series, []), history_dtype)
+        pending = np.sort(pending[(pending['t'] >= start) & (pending['t'] < end)], order='t')
+        records = np.concatenate(parts + [pending])
+        return records['t'], records['v'].astype(float)
+
+    def value_near(self, series, t, tolerance):
+        import numpy as np
+        times, values = self.query(series, t - tolerance, t + tolerance)
+        if not len(times):
+            return None
+        return values[np.argmin(abs(times - t))]
+
+    def latest(self, series, within=86400):
+        times, values = self.query(series, time.time() - within)
+        if not len(times):
+            return None
+        return times[-1], values[-1]
+
+
+class DataCache:
+    # TTL + LRU cache keyed by (provider, location). Concurrent get()s for the
+    # same key share a single in-flight fetch instead of each going upstream.
+
+    def __init__(self, ttls=None, max_entries=cache_max_entries):
+        self.ttls = cache_ttls if ttls is None else ttls
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (expires, value)
+        self.pending = {}  # key -> Future of the fetch in flight
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, provider, location, fetch):
+        key = (provider, location)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            future = self.pending.get(key)
+            if future is not None:
+                self.coalesced += 1
+            else:
+                self.misses += 1
+                owned = self.pending[key] = Future()
+        if future is not None:
+            return future.result()
+
+        try:
+            value = fetch()
+        except BaseException as e:
+            with self.lock:
+                del self.pending[key]
+            owned.set_exception(e)
+            raise
+        with self.lock:
+            self.entries[key] = (time.monotonic() + scaled(self.ttls.get(provider, 0)), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            del self.pending[key]
+        owned.set_result(value)
+        return value
+
+    def put(self, provider, location, value):
+        # store a value that arrived without a get(), e.g. pushed by a hub
+        with self.lock:
+            self.entries[(provider, location)] = (time.monotonic() + scaled(self.ttls.get(provider, 0)), value)
+            self.entries.move_to_end((provider, location))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def peek(self, provider, location):
+        # whatever is cached, expired or not, without touching the counters
+        with self.lock:
+            entry = self.entries.get((provider, location))
+        return None if entry is None else entry[1]
+
+    def payload_bytes(self):
+        with self.lock:
+            values = [value for _, value in self.entries.values()]
+        return sum(payload_size(value.data) for value in values)
+
+    def trim(self, max_bytes):
+        # evict least recently used entries until the payloads fit in max_bytes
+        with self.lock:
+            sizes = [(key, payload_size(value.data)) for key, (_, value) in self.entries.items()]
+            total = sum(size for _, size in sizes)
+            evicted = 0
+            for key, size in sizes:
+                if total <= max_bytes:
+                    break
+                del self.entries[key]
+                total -= size
+                evicted += 1
+        return evicted
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'coalesced': self.coalesced,
+                    'entries': len(self.entries), 'saved': self.hits + self.coalesced}
+
+    def report(self):
+        return 'cache: %(hits)i hits, %(misses)i misses, %(coalesced)i coalesced, ' \
+               '%(saved)i upstream calls saved' % self.stats()
+
+
+def news_url(country_code):
+    if country_code == None:
+        return "https://news.google.com/news?ned=us&output=rss"
+    return "https://news.google.com/news?ned=%s&output=rss" % country_code
+
+
+def parse_news(content, headers=None):
+    # keep only what the panel shows so the snapshot stays small
+    import feedparser
+    with metrics.timer('smartmirror_parse_seconds', provider='news'):
+        feed = feedparser.parse(content, response_headers=headers)
+    return [{'title': post.title, 'link': post.get('link', '')} for post in feed.entries]
+
+
+# returned by a provider when upstream says its data has not changed
+NOT_MODIFIED = object()
+
+# providers read on each mirror itself, never through a hub
+local_providers = ('calendar',)
+
+
+def unescape_ics(text):
+    return re.sub(r'\\([\\;,nN])', lambda m: '\n' if m.group(1) in 'nN' else m.group(1), text)
+
+
+def parse_ics_time(value, params):
+    # (local naive datetime, all day?) of a DATE or DATE-TIME value; UTC and
+    # TZID times are converted to local time, floating times are kept as is
+    value = value.strip()
+    if params.get('VALUE') == 'DATE' or len(value) == 8:
+        return datetime.strptime(value[:8], '%Y%m%d'), True
+    start = datetime.strptime(value[:15], '%Y%m%dT%H%M%S')
+    if value.endswith('Z'):
+        return start.replace(tzinfo=timezone.utc).astimezone().replace(tzinfo=None), False
+    if 'TZID' in params:
+        try:
+            import zoneinfo
+            zone = zoneinfo.ZoneInfo(params['TZID'].strip('"'))
+        except Exception:
+            return start, False
+        return start.replace(tzinfo=zone).astimezone().replace(tzinfo=None), False
+    return start, False
+
+
+def parse_ics_duration(value):
+    match = re.match(r'([+-])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$', value.strip())
+    if match is None:
+        return timedelta(0)
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    duration = timedelta(weeks=int(weeks or 0), days=int(days or 0), hours=int(hours or 0),
+                         minutes=int(minutes or 0), seconds=int(seconds or 0))
+    return -duration if sign == '-' else duration
+
+
+def parse_vevent(block):
+    props = {}
+    exdates = set()
+    depth = 0
+    for line in block.splitlines():
+        name, sep, value = line.partition(':')
+        if not sep:
+            continue
+        # properties of nested components (VALARM's UID, SUMMARY, ...) are not the event's
+        if name.upper() == 'BEGIN':
+            depth += 1
+        elif name.upper() == 'END':
+            depth = max(depth - 1, 0)
+        if depth or name.upper() == 'END':
+            continue
+        name, *params = name.split(';')
+        params = dict(param.split('=', 1) for param in params if '=' in param)
+        name = name.upper()
+        if name == 'EXDATE':
+            exdates.update(parse_ics_time(item, params)[0] for item in value.split(','))
+        else:
+            props[name] = (value, params)
+    if 'DTSTART' not in props or props.get('STATUS', ('',))[0].upper() == 'CANCELLED':
+        return None
+    start, all_day = parse_ics_time(*props['DTSTART'])
+    if 'DTEND' in props:
+        end = parse_ics_time(*props['DTEND'])[0]
+    elif 'DURATION' in props:
+        end = start + parse_ics_duration(props['DURATION'][0])
+    else:
+        end = start + (timedelta(days=1) if all_day else timedelta(0))
+    rrule = props.get('RRULE', (None,))[0]
+    if rrule:
+        # UNTIL in UTC next to a local DTSTART would make dateutil refuse the rule
+        rrule = re.sub(r'UNTIL=(\d{8}T\d{6})Z', lambda m: 'UNTIL=' + parse_ics_time(m.group(1) + 'Z', {})[0]
+                       .strftime('%Y%m%dT%H%M%S'), rrule)
+    return {'uid': props.get('UID', ('',))[0], 'summary': unescape_ics(props.get('SUMMARY', ('',))[0]),
+            'start': start, 'end': end, 'all_day': all_day, 'rrule': rrule, 'exdates': exdates,
+            'recurrence_id': parse_ics_time(*props['RECURRENCE-ID'])[0] if 'RECURRENCE-ID' in props else None}
+
+
+class IcsCalendar:
+    # Upcoming events from calendar_paths. A file is only read again when
+    # its mtime or size changed, and then only VEVENTs whose text changed
+    # get parsed. One-off events are kept sorted by start and recurring ones
+    # are expanded lazily with dateutil.rrule. dateutil always iterates a
+    # rule from its DTSTART, so each rule is rebased onto its latest past
+    # occurrence as time goes on; the next k events then cost a bisect, k
+    # steps of a merge and the occurrences since the previous call, however
+    # much history the files hold.
+
+    def __init__(self, paths=None):
+        self.paths = calendar_paths if paths is None else paths
+        self.files = {}  # path -> ((mtime, size), [VEVENT hashes])
+        self.parsed = {}  # VEVENT hash -> event, or None when unusable
+        self.starts = []
+        self.single = []
+        self.recurring = []  # (event, start times replaced by an override)
+        self.longest = timedelta(0)
+
+    def refresh(self):
+        changed = False
+        paths = [os.path.expanduser(path) for path in self.paths]
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError as e:
+                print("Error: %s. Cannot read calendar %s." % (e, path))
+                changed = self.files.pop(path, None) is not None or changed
+                continue
+            stamp = (st.st_mtime_ns, st.st_size)
+            if path in self.files and self.files[path][0] == stamp:
+                continue
+            self.files[path] = (stamp, self.read(path))
+            changed = True
+        for path in set(self.files) - set(paths):
+            del self.files[path]
+            changed = True
+        if changed:
+            self.build_index()
+        return changed
+
+    def read(self, path):
+        with metrics.timer('smartmirror_parse_seconds', provider='calendar'):
+            with open(path, encoding='utf-8', errors='replace') as f:
+                text = re.sub(r'\r?\n[ \t]', '', f.read())
+            hashes = []
+            for block in re.findall(r'^BEGIN:VEVENT\r?$(.*?)^END:VEVENT\r?$', text, re.M | re.S):
+                digest = hashlib.blake2b(block.encode(), digest_size=16).hexdigest()
+                if digest not in self.parsed:
+                    try:
+                        self.parsed[digest] = parse_vevent(block)
+                    except Exception as e:
+                        print("Error: %s. Skipping an event in %s." % (e, path))
+                        self.parsed[digest] = None
+                hashes.append(digest)
+        return hashes
+
+    def build_index(self):
+        from dateutil import rrule
+        live = set(digest for _, hashes in self.files.values() for digest in hashes)
+        self.parsed = dict((digest, event) for digest, event in self.parsed.items() if digest in live)
+        events = [event for event in self.parsed.values() if event is not None]
+        overrides = {}
+        for event in events:
+            if event['recurrence_id'] is not None:
+                overrides.setdefault(event['uid'], set()).add(event['recurrence_id'])
+        self.single = sorted((event for event in events if not event['rrule']), key=lambda event: event['start'])
+        self.starts = [event['start'] for event in self.single]
+        self.recurring = []
+        for event in events:
+            if event['rrule']:
+                if 'rule' not in event:
+                    try:
+                        event['rule'] = rrule.rrulestr(event['rrule'], dtstart=event['start'])
+                    except Exception as e:
+                        print("Error: %s. Ignoring the recurrence of %s." % (e, event['summary']))
+                        continue
+                    count = re.search(r'COUNT=(\d+)', event['rrule'], re.I)
+                    event['count'] = int(count.group(1)) if count else None
+                    event['base'] = (event['rule'], event['count'])
+                    event['anchor'] = event['start']
+                self.recurring.append((event, event['exdates'] | overrides.get(event['uid'], set())))
+        self.longest = max([event['end'] - event['start'] for event in events] + [timedelta(0)])
+
+    def rebase(self, event, since):
+        # restart the rule at its last occurrence before since; only the
+        # occurrences since the previous rebase are walked
+        if since < event['anchor']:
+            # the clock went back (NTP on a Pi without RTC): from DTSTART again
+            event['rule'], event['count'] = event['base']
+            event['anchor'] = event['start']
+        anchor, passed = None, 0
+        for start in event['rule']:
+            if start >= since:
+                break
+            anchor, passed = start, passed + 1
+        if passed > 1:
+            if event['count'] is not None:
+                event['count'] -= passed - 1
+            event['rule'] = event['rule'].replace(dtstart=anchor, count=event['count'])
+            event['anchor'] = anchor
+
+    def occurrences(self, event, skip, since):
+        duration = event['end'] - event['start']
+        self.rebase(event, since - duration)
+        for start in event['rule'].xafter(since - duration, inc=True):
+            if start not in skip:
+                yield start, start + duration, event
+
+    def upcoming(self, count=calendar_event_count, now=None):
+        # the next count events that have not ended yet, soonest first
+        now = datetime.now() if now is None else now
+        self.refresh()
+        first = bisect.bisect_left(self.starts, now - self.longest)
+        single = ((event['start'], event['end'], event) for event in self.single[first:])
+        merged = heapq.merge(single, *[self.occurrences(event, skip, now) for event, skip in self.recurring],
+                             key=lambda occurrence: occurrence[0])
+        events = []
+        for start, end, event in merged:
+            if end > now or (end == start and start >= now):
+                events.append({'summary': event['summary'], 'start': start.isoformat(), 'end': end.isoformat(),
+                               'all_day': event['all_day']})
+                if len(events) == count:
+                    break
+        return events
+
+
+class HttpClient:
+    # One keep-alive session shared by every HTTP fetch the mirror makes
+    # itself. ETag / Last-Modified are remembered per URL, so an unchanged
+    # resource costs a 304 with no body. requests already asks for gzip.
+    # The session is made on first use, on a pool thread, so importing
+    # requests is not in the way of the first frame.
+
+    def __init__(self, pool_size=http_pool_size, timeout=http_timeout):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._session = None
+        self.validators = {}
+        self.lock = threading.Lock()
+
+    @property
+    def session(self):
+        with self.lock:
+            if self._session is None:
+                import_modules(['requests', 'requests.adapters'])
+                import requests
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=self.pool_size,
+                                                        pool_maxsize=self.pool_size)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._session = session
+            return self._session
+
+    def get(self, url, conditional=True):
+        # returns None when the server says the resource has not changed
+        headers = {}
+        with self.lock:
+            validators = self.validators.get(url, {})
+        if conditional and 'ETag' in validators:
+            headers['If-None-Match'] = validators['ETag']
+        if conditional and 'Last-Modified' in validators:
+            headers['If-Modified-Since'] = validators['Last-Modified']
+
+        response = self.session.get(url, headers=headers, timeout=self.timeout)
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+
+        validators = dict((name, response.headers[name]) for name in ('ETag', 'Last-Modified')
+                          if name in response.headers)
+        with self.lock:
+            self.validators[url] = validators
+        return response
+
+
+# provider -> (module, class, method) of the scraper behind it
+scrapers = {
+    'weather': ('GoogleWeather.GoogleWeather', 'GoogleWeatherAPI', 'GetDataFromRegion'),
+    'surf': ('SurflineScraper.SurflineScraper', 'SurflineScraper', 'GetData'),
+    'wind': ('iWindsurfScraper.iWindsurfScraper', 'iWindsurfScraper', 'GetData'),
 }
 
 
+def pack_payload(data):
+    # DataFrames cross the process boundary as plain arrays (index + one per
+    # column), which pickle protocol 5 hands over as out-of-band buffers
+    if not (hasattr(data, 'columns') and hasattr(data, 'index')):
+        return ('data', data)
+    index = data.index
+    tz = getattr(index, 'tz', None)
+    if tz is not None:
+        index = index.tz_convert('UTC').tz_localize(None)
+    arrays = [data.iloc[:, idx].to_numpy() for idx in range(len(data.columns))]
+    return ('frame', index.to_numpy(), index.name, None if tz is None else str(tz), list(data.columns), arrays)
+
+
+def unpack_payload(packed):
+    if packed[0] != 'frame':
+        return packed[1]
+    import pandas as pd
+    _, values, name, tz, columns, arrays = packed
+    index = pd.Index(values, name=name)
+    if tz is not None:
+        index = index.tz_localize('UTC').tz_convert(tz)
+    frame = pd.DataFrame(dict(enumerate(arrays)), index=index)
+    frame.columns = columns
+    return frame
+
+
+def encode_array(values):
+    if values.dtype.kind in 'mM':
+        return {'dtype': str(values.dtype), 'values': values.view('i8').tolist()}
+    return {'dtype': str(values.dtype) if values.dtype.kind in 'biuf' else 'object', 'values': values.tolist()}
+
+
+def decode_array(encoded):
+    import numpy as np
+    dtype = np.dtype(encoded['dtype'])
+    if dtype.kind in 'mM':
+        return np.array(encoded['values'], dtype='i8').view(dtype)
+    return np.array(encoded['values'], dtype=dtype)
+
+
+def encode_payload(data):
+    # JSON-able form of a provider payload, for the hub
+    packed = pack_payload(data)
+    if packed[0] != 'frame':
+        return {'data': packed[1]}
+    _, index, name, tz, columns, arrays = packed
+    return {'index': encode_array(index), 'index_name': name, 'tz': tz, 'columns': columns,
+            'arrays': [encode_array(values) for values in arrays]}
+
+
+def decode_payload(encoded):
+    if 'data' in encoded:
+        return encoded['data']
+    return unpack_payload(('frame', decode_array(encoded['index']), encoded['index_name'], encoded['tz'],
+                           encoded['columns'], [decode_array(values) for values in encoded['arrays']]))
+
+
+def provider_worker(provider, conn):
+    # runs in the worker process: one request at a time, until the pipe closes
+    module, cls, method = scrapers[provider]
+    import_modules([module])
+    fetch = getattr(getattr(sys.modules[module], cls)(), method)
+    while True:
+        try:
+            location = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        try:
+            packed = pack_payload(fetch(location))
+        except Exception as e:
+            conn.send(('error', '%s: %s' % (type(e).__name__, e)))
+            continue
+        buffers = []
+        header = pickle.dumps(packed, protocol=5, buffer_callback=buffers.append)
+        conn.send(('ok', len(buffers)))
+        conn.send_bytes(header)
+        for buffer in buffers:
+            conn.send_bytes(buffer.raw())
+
+
+class ProviderWorker:
+    # Supervises the worker process of one provider. fetch() blocks the
+    # calling pool thread; a worker that does not answer within the timeout
+    # is killed, and a dead or killed worker is replaced right away.
+
+    def __init__(self, provider, timeout=None):
+        self.provider = provider
+        self.timeout = fetch_timeouts.get(provider, 60) if timeout is None else timeout
+        self.lock = threading.Lock()
+        self.process = None
+        self.conn = None
+        self.restarts = 0
+        self.closed = False
+
+    def start(self):
+        import multiprocessing
+        context = multiprocessing.get_context('spawn')
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=provider_worker, args=(self.provider, child),
+                                       name='%s-worker' % self.provider, daemon=True)
+        self.process.start()
+        child.close()
+
+    def stop(self):
+        if self.process is None:
+            return
+        self.conn.close()
+        self.process.kill()
+        self.process.join(5)
+        self.process = None
+        self.conn = None
+
+    def restart(self, reason):
+        print('Restarting %s worker: %s' % (self.provider, reason))
+        self.restarts += 1
+        metrics.increment('smartmirror_worker_restarts_total', provider=self.provider)
+        self.stop()
+        if not self.closed:
+            self.start()
+
+    def close(self):
+        # does not wait for a fetch in flight; that one fails instead
+        self.closed = True
+        self.stop()
+
+    def fetch(self, location):
+        with self.lock:
+            if self.closed:
+                raise RuntimeError('%s worker is closed' % self.provider)
+            if self.process is None:
+                self.start()
+            elif not self.process.is_alive():
+                self.restart('exited with code %s' % self.process.exitcode)
+            try:
+                self.conn.send(location)
+                answered = self.conn.poll(self.timeout)
+                if answered:
+                    status, value = self.conn.recv()
+                    if status == 'ok':
+                        header = self.conn.recv_bytes()
+                        buffers = [self.conn.recv_bytes() for _ in range(value)]
+            except (EOFError, OSError):
+                if self.process is not None:  # None when close() got there first
+                    self.process.join(1)
+                    self.restart('exited with code %s' % self.process.exitcode)
+                raise RuntimeError('%s worker died fetching %s' % (self.provider, location))
+            if not answered:
+                self.restart('no answer in %ss' % self.timeout)
+                raise TimeoutError('%s worker timed out on %s' % (self.provider, location))
+        if status == 'error':
+            raise RuntimeError(value)
+        return unpack_payload(pickle.loads(header, buffers=buffers))
+
+
+class WorkerPool:
+    # The ProviderWorkers of one provider, so its locations still fetch in
+    # parallel. Workers are started on demand up to size and then reused,
+    # most recently used first, so the spare ones can stay unstarted.
+
+    def __init__(self, provider, size=isolated_workers):
+        self.provider = provider
+        self.size = max(size, 1)
+        self.workers = []
+        self.free = queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def checkout(self):
+        with self.lock:
+            if self.closed:
+                raise RuntimeError('%s worker is closed' % self.provider)
+            try:
+                return self.free.get_nowait()
+            except queue.Empty:
+                pass
+            if len(self.workers) < self.size:
+                worker = ProviderWorker(self.provider)
+                self.workers.append(worker)
+                return worker
+        try:
+            return self.free.get(timeout=fetch_timeouts.get(self.provider, 60))
+        except queue.Empty:
+            raise TimeoutError('no free %s worker' % self.provider)
+
+    def fetch(self, location):
+        worker = self.checkout()
+        try:
+            return worker.fetch(location)
+        finally:
+            self.free.put(worker)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            workers = list(self.workers)
+        for worker in workers:
+            worker.close()
+
+
+class DataSource:
+    # One set of scrapers shared by every panel, with the cache in front of
+    # them so panels asking for the same region only pay for it once.
+
+    def __init__(self, cache=None, snapshots=None, http=None, history=None, recorder=None):
+        self.cache = DataCache() if cache is None else cache
+        self.recorder = Recorder() if recorder is None and record_dir else recorder
+        self.snapshots = SnapshotStore() if snapshots is None else snapshots
+        self.history = TimeSeriesStore() if history is None else history
+        self.http = HttpClient() if http is None else http
+        self.requests = dict((provider, deque(maxlen=1000)) for provider in refresh_policies)
+        self.clients = {}
+        self.providers = {
+            'weather': lambda region: self.google_weather.GetDataFromRegion(region),
+            'surf': lambda region: self.surfline.GetData(region),
+            'wind': lambda location: self.iwindsurf.GetData(location),
+            'news': self.get_news,
+            'calendar': lambda location: self.calendar.upcoming(),
+        }
+        self.calendar = IcsCalendar()
+        self.workers = dict((provider, WorkerPool(provider))
+                            for provider in isolated_providers if provider in scrapers)
+        for provider, worker in self.workers.items():
+            self.providers[provider] = worker.fetch
+
+    def client(self, provider):
+        # scrapers (and pandas behind them) are only imported once needed
+        if provider not in self.clients:
+            module, cls, _ = scrapers[provider]
+            import_modules([module])
+            self.clients[provider] = getattr(sys.modules[module], cls)()
+        return self.clients[provider]
+
+    @property
+    def google_weather(self):
+        return self.client('weather')
+
+    @property
+    def surfline(self):
+        return self.client('surf')
+
+    @property
+    def iwindsurf(self):
+        return self.client('wind')
+
+    def close(self):
+        for worker in self.workers.values():
+            worker.close()
+        self.history.flush()
+
+    def get_news(self, country_code):
+        # only ask for a 304 if there is something to fall back on
+        have_data = self.peek('news', country_code) is not None
+        response = self.http.get(news_url(country_code), conditional=have_data)
+        if response is None:
+            return NOT_MODIFIED
+        return parse_news(response.content, response.headers)
+
+    def request_rate(self, provider, window=3600):
+        # upstream requests made for a provider over the last window seconds
+        since = time.time() - window
+        return sum(1 for t in list(self.requests[provider]) if t > since)
+
+    def fetch(self, provider, location):
+        # always goes upstream, and remembers the result on disk
+        self.requests.setdefault(provider, deque(maxlen=1000)).append(time.time())
+        print('Fetching %s for %s. %s' % (provider, location, self.cache.report()))
+        start = time.perf_counter()
+        try:
+            with metrics.timer('smartmirror_fetch_seconds', provider=provider):
+                data = self.providers[provider](location)
+        except Exception as e:
+            metrics.increment('smartmirror_fetch_failures_total', provider=provider)
+            if self.recorder is not None:
+                self.recorder.save(provider, location, time.perf_counter() - start, error='%s: %s' % (type(e).__name__, e))
+            raise
+        if self.recorder is not None:
+            self.recorder.save(provider, location, time.perf_counter() - start, data)
+        if data is NOT_MODIFIED:
+            print('%s for %s not modified' % (provider, location))
+            previous = self.peek(provider, location)
+            if previous is None:
+                metrics.increment('smartmirror_fetch_failures_total', provider=provider)
+                raise RuntimeError('%s for %s not modified, but there is nothing to fall back on' % (provider, location))
+            result = ProviderResult(provider, location, previous.data, version=previous.version)
+        else:
+            result = ProviderResult(provider, location, data)
+        self.snapshots.save(result)
+        self.history.record_result(result)
+        return result
+
+    def get(self, provider, location):
+        return self.cache.get(provider, location, lambda: self.fetch(provider, location))
+
+    def peek(self, provider, location):
+        # best data available without a network call: cached, else on disk
+        result = self.cache.peek(provider, location)
+        if result is None:
+            result = self.snapshots.load(provider, location)
+        return result
+
+
+class Recorder:
+    # Saves every provider response, or failure, with how long it took, as
+    # record_dir/<provider>-<location>/<time>.pkl.gz for ReplaySource.
+
+    def __init__(self, path=None):
+        self.path = record_dir if path is None else path
+
+    def save(self, provider, location, elapsed, data=None, error=None):
+        directory = os.path.join(self.path, safe_name(provider, location))
+        capture = {'provider': provider, 'location': location, 'elapsed': elapsed, 'fetched_at': time.time(),
+                   'not_modified': data is NOT_MODIFIED, 'data': None if data is NOT_MODIFIED else data,
+                   'error': error}
+        try:
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, '%.6f.pkl.gz' % capture['fetched_at'])
+            with gzip.open(path + '.tmp', 'wb') as f:
+                pickle.dump(capture, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(path + '.tmp', path)
+        except Exception as e:
+            print("Error: %s. Cannot record %s %s." % (e, provider, location))
+
+
+def load_captures(path):
+    # (provider, location) -> captures in the order they were recorded
+    captures = {}
+    for directory in sorted(os.listdir(path)):
+        names = [name for name in os.listdir(os.path.join(path, directory)) if name.endswith('.pkl.gz')]
+        for name in sorted(names, key=lambda name: float(name[:-len('.pkl.gz')])):
+            try:
+                with gzip.open(os.path.join(path, directory, name), 'rb') as f:
+                    capture = pickle.load(f)
+            except Exception as e:
+                print("Error: %s. Skipping capture %s." % (e, name))
+                continue
+            captures.setdefault((capture['provider'], capture['location']), []).append(capture)
+    return captures
+
+
+class ReplaySource(DataSource):
+    # DataSource serving captures made by a Recorder instead of going
+    # upstream. Every (provider, location) cycles through its captures in
+    # order; local providers without captures are read for real.
+
+    def __init__(self, path=None, latency=None, jitter=None, failure_rate=None, **kwargs):
+        DataSource.__init__(self, **kwargs)
+        self.path = replay_dir if path is None else path
+        self.latency = replay_latency if latency is None else latency
+        self.jitter = replay_jitter if jitter is None else jitter
+        self.failure_rate = replay_failure_rate if failure_rate is None else failure_rate
+        self.captures = load_captures(self.path)
+        print('Replaying %i captures of %i feeds from %s' % (sum(len(c) for c in self.captures.values()),
+                                                            len(self.captures), self.path))
+        self.positions = {}
+        self.lock = threading.Lock()
+        self.random = random.Random()
+        self.live = dict(self.providers)
+        for provider in self.providers:
+            self.providers[provider] = lambda location, provider=provider: self.replay(provider, location)
+
+    def next_capture(self, key):
+        captures = self.captures[key]
+        with self.lock:
+            idx = self.positions.get(key, 0)
+            for skip in range(len(captures)):
+                capture = captures[(idx + skip) % len(captures)]
+                # a 304 only means something with data to fall back on
+                if not capture['not_modified'] or self.peek(*key) is not None:
+                    break
+            else:
+                raise RuntimeError('Only 304s recorded for %s %s' % key)
+            self.positions[key] = idx + skip + 1
+        return capture
+
+    def replay(self, provider, location):
+        if (provider, location) not in self.captures:
+            if provider in local_providers:
+                return self.live[provider](location)
+            raise RuntimeError('Nothing recorded for %s %s' % (provider, location))
+        capture = self.next_capture((provider, location))
+        latency = capture['elapsed'] if self.latency is None else self.latency
+        time.sleep(scaled(max(0., latency * (1 + self.random.uniform(-self.jitter, self.jitter)))))
+        if self.random.random() < self.failure_rate:
+            raise RuntimeError('Injected failure for %s %s' % (provider, location))
+        if capture['error']:
+            raise RuntimeError(capture['error'])
+        return NOT_MODIFIED if capture['not_modified'] else capture['data']
+
+
+class RefreshPolicy:
+    def __init__(self, interval, min_interval, max_interval, backoff=2, jitter=0.1, publish_times=()):
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.publish_times = [tuple(int(part) for part in hhmm.split(':')) for hhmm in publish_times]
+
+    def seconds_to_publish(self, now):
+        # seconds until the next publish window opens, 0 while inside one
+        if not self.publish_times:
+            return None
+        local = time.localtime(now)
+        seconds = local.tm_hour * 3600 + local.tm_min * 60 + local.tm_sec
+        best = None
+        for hour, minute in self.publish_times:
+            offset = (hour * 3600 + minute * 60 - seconds) % 86400
+            if offset > 86400 - publish_window or offset <= publish_window:
+                return 0
+            offset -= publish_window
+            best = offset if best is None else min(best, offset)
+        return best
+
+    def next_delay(self, delay, changed, failed):
+        # the unjittered delay that follows a refresh
+        if delay is None or (changed and not failed):
+            delay = self.interval
+        else:
+            delay = min(delay * self.backoff, self.max_interval)
+        return delay
+
+    def wait(self, delay, now=None):
+        # the actual wait for a delay: jittered, and cut short so a publish
+        # window is never slept through
+        now = time.time() if now is None else now
+        wait = delay * (1 + random.uniform(-self.jitter, self.jitter))
+        to_publish = self.seconds_to_publish(now)
+        if to_publish == 0:
+            wait = min(wait, self.min_interval)
+        elif to_publish is not None:
+            wait = min(wait, to_publish)
+        return max(wait, 1)
+
+
+class Watch:
+    def __init__(self, provider, location, policy):
+        self.provider = provider
+        self.location = location
+        self.policy = policy
+        self.listeners = []
+        self.delay = None
+        self.version = None
+        self.paused = False
+
+
+class FetchJob:
+    def __init__(self, key, timeout):
+        self.key = key
+        self.timeout = timeout
+        self.listeners = []
+        self.started = time.monotonic()
+        self.timed_out = False
+
+
+class FetchScheduler:
+    # Runs provider fetches on a thread pool so network calls never block the
+    # Tk main loop. Results come back through a queue that is drained from an
+    # after() callback, so callbacks and errbacks always run on the Tk thread.
+
+    def __init__(self, root, source, max_workers=fetch_workers, poll_ms=100):
+        self.root = root
+        self.source = source
+        self.poll_ms = poll_ms
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='fetch')
+        self.results = queue.Queue()
+        self.in_flight = {}
+        self.policies = dict((provider, RefreshPolicy(**policy)) for provider, policy in refresh_policies.items())
+        self.watches = {}
+        self.render = None  # RenderScheduler panel updates go through, if any
+        self.draining = False
+        # what each watch is planned to cost against what went upstream
+        metrics.gauge('smartmirror_planned_refreshes_per_hour', lambda: [
+            ({'provider': provider, 'location': location}, rate) for (provider, location), rate in self.rates().items()])
+        metrics.gauge('smartmirror_upstream_requests_last_hour', lambda: [
+            ({'provider': provider}, self.source.request_rate(provider)) for provider in sorted(self.source.requests)])
+
+    def watch(self, provider, location, callback, errback=None):
+        # Keep (provider, location) refreshed according to its policy and
+        # report every result or failure. All watchers of a key share one
+        # refresh loop.
+        key = (provider, location)
+        watch = self.watches.get(key)
+        if watch is None:
+            watch = self.watches[key] = Watch(provider, location, self.policies[provider])
+            self.root.after(0, lambda: self._refresh(watch))
+        watch.listeners.append((callback, errback))
+
+    def _refresh(self, watch):
+        if self.render is not None and self.render.idle and watch.provider in idle_paused_providers:
+            # picked up again by resume()
+            watch.paused = True
+            return
+        self.fetch(watch.provider, watch.location,
+                   lambda result: self._refreshed(watch, result, None),
+                   lambda e: self._refreshed(watch, None, e))
+
+    def _refreshed(self, watch, result, error):
+        changed = result is not None and result.version != watch.version
+        if result is not None:
+            watch.version = result.version
+        watch.delay = watch.policy.next_delay(watch.delay, changed, error is not None)
+        wait = watch.policy.wait(watch.delay)
+        print('Refreshing %s for %s again in %is (%i upstream requests in the last hour)'
+              % (watch.provider, watch.location, wait, self.source.request_rate(watch.provider)))
+
+        for callback, errback in watch.listeners:
+            self._deliver(callback, errback, error is None, result if error is None else error,
+                          (watch.provider, watch.location))
+        self.root.after(int(scaled(wait) * 1000), lambda: self._refresh(watch))
+
+    def resume(self):
+        # refresh every watch that was paused while idle
+        for watch in self.watches.values():
+            if watch.paused:
+                watch.paused = False
+                self.root.after(0, lambda watch=watch: self._refresh(watch))
+
+    def update(self, key, func, value):
+        # a panel update, through the render scheduler when there is one
+        if self.render is not None:
+            self.render.submit(key, func, value)
+        else:
+            func(value)
+
+    def rates(self):
+        # planned refreshes per hour for every watched key
+        return dict((key, 3600. / watch.delay) for key, watch in list(self.watches.items()) if watch.delay)
+
+    def fetch(self, provider, location, callback, errback=None):
+        return self.submit((provider, location), lambda: self.source.get(provider, location),
+                           callback, errback, timeout=fetch_timeouts.get(provider))
+
+    def submit(self, key, fetch, callback, errback=None, timeout=None):
+        # Only one fetch per key is outstanding at a time; a second request
+        # for the same key just waits on the first one's result. A fetch that
+        # overruns its timeout is reported as failed right away, but keeps its
+        # key busy until the worker returns, so a hung provider can only ever
+        # tie up its own slot in the pool.
+        job = self.in_flight.get(key)
+        if job is not None:
+            if job.timed_out:
+                error = TimeoutError('%s is still hung' % (key,))
+                self.root.after(0, lambda: self._notify(callback, errback, False, error, key))
+            else:
+                job.listeners.append((callback, errback))
+            return False
+        job = FetchJob(key, timeout)
+        job.listeners.append((callback, errback))
+        self.in_flight[key] = job
+        self.pool.submit(self._run, job, fetch)
+        self._arm()
+        return True
+
+    def _run(self, job, fetch):
+        try:
+            self.results.put((job, True, fetch()))
+        except Exception as e:
+            self.results.put((job, False, e))
+
+    def _deliver(self, callback, errback, ok, value, key):
+        # watch results go through the render scheduler, which may hold them
+        handler = callback if ok else errback
+        if self.render is None or handler is None:
+            self._notify(callback, errback, ok, value, key)
+        else:
+            self.render.submit((key, handler), handler, value)
+
+    def _notify(self, callback, errback, ok, value, key):
+        try:
+            if ok:
+                callback(value)
+            elif errback is not None:
+                errback(value)
+            else:
+                print("Error: %s. Fetch for %s failed." % (value, key))
+        except Exception:
+            traceback.print_exc()
+
+    def _finish(self, job, ok, value):
+        for callback, errback in job.listeners:
+            self._notify(callback, errback, ok, value, job.key)
+        job.listeners = []
+
+    def _arm(self, delay_ms=None):
+        # results are only polled for while fetches are in flight, so an idle
+        # mirror's event loop is not woken up for nothing
+        if not self.draining:
+            self.draining = True
+            self.root.after(self.poll_ms if delay_ms is None else delay_ms, self._drain)
+
+    def _drain(self):
+        self.draining = False
+        while True:
+            try:
+                job, ok, value = self.results.get_nowait()
+            except queue.Empty:
+                break
+            del self.in_flight[job.key]
+            if job.timed_out:
+                print('Discarding late result for %s' % (job.key,))
+                continue
+            self._finish(job, ok, value)
+
+        now = time.monotonic()
+        for job in list(self.in_flight.values()):
+            if job.timeout and not job.timed_out and now - job.started > job.timeout:
+                job.timed_out = True
+                self._finish(job, False, TimeoutError('%s timed out after %ss' % (job.key, job.timeout)))
+
+        if self.in_flight:
+            self._arm()
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+class RenderScheduler:
+    # Runs panel updates (see FetchScheduler.update) so they stay cheap for
+    # the event loop and the power bill. Updates are queued, a newer one
+    # for the same key replacing the one waiting, and run at most
+    # frame_budget seconds' worth per event-loop turn, so panels refreshing
+    # together are staggered over several turns. While idle nothing runs
+    # and the queue only coalesces; waking runs it all once.
+
+    def __init__(self, root, scheduler, budget=None, gap_ms=None):
+        self.root = root
+        self.scheduler = scheduler
+        self.budget = frame_budget if budget is None else budget
+        self.gap_ms = frame_gap_ms if gap_ms is None else gap_ms
+        self.pending = OrderedDict()  # key -> (func, value)
+        self.scheduled = False
+        self.idle = False
+        self.dpms_off = False
+        self.on_wake = []  # called once when the mirror next wakes up
+        scheduler.render = self
+        metrics.gauge('smartmirror_idle', lambda: [({}, int(self.idle))])
+        self.check()
+
+    def submit(self, key, func, value):
+        if key in self.pending:
+            metrics.increment('smartmirror_updates_coalesced_total')
+        self.pending[key] = (func, value)
+        self.kick()
+
+    def kick(self):
+        if not self.scheduled and not self.idle and self.pending:
+            self.scheduled = True
+            self.root.after(self.gap_ms, self.run)
+
+    def run(self):
+        self.scheduled = False
+        if self.idle:
+            return
+        start = time.perf_counter()
+        while self.pending:
+            _, (func, value) = self.pending.popitem(last=False)
+            try:
+                func(value)
+            except Exception:
+                traceback.print_exc()
+            if time.perf_counter() - start > self.budget:
+                break
+        metrics.observe('smartmirror_frame_seconds', time.perf_counter() - start)
+        if self.pending:
+            metrics.increment('smartmirror_frames_deferred_total')
+            self.kick()
+
+    def in_idle_hours(self, now=None):
+        if not idle_hours:
+            return False
+        now = time.localtime() if now is None else now
+        minute = now.tm_hour * 60 + now.tm_min
+        start, end = [int(hhmm[:2]) * 60 + int(hhmm[3:5]) for hhmm in idle_hours]
+        return start <= minute < end if start <= end else minute >= start or minute < end
+
+    def present(self):
+        try:
+            return time.time() - os.path.getmtime(os.path.expanduser(presence_file)) < presence_timeout
+        except OSError:
+            return False
+
+    def query_dpms(self):
+        import subprocess
+        output = subprocess.run(['xset', 'q'], capture_output=True, text=True, timeout=5).stdout
+        return bool(re.search(r'Monitor is (Off|in Standby|in Suspend)', output))
+
+    def dpms_checked(self, off):
+        self.dpms_off = off
+
+    def should_idle(self):
+        if self.dpms_off:
+            return True
+        if presence_file:
+            return not self.present()
+        return self.in_idle_hours()
+
+    def check(self):
+        if idle_dpms:
+            # xset runs on the fetch pool; its answer counts from the next check
+            self.scheduler.submit(('idle', 'dpms'), self.query_dpms, self.dpms_checked,
+                                  lambda e: print("Error: %s. Cannot query DPMS." % e), timeout=10)
+        idle = self.should_idle()
+        if idle != self.idle:
+            self.idle = idle
+            if idle:
+                print('Going idle')
+            else:
+                print('Waking up, %i panel updates waiting' % len(self.pending))
+                self.scheduler.resume()
+                callbacks, self.on_wake = self.on_wake, []
+                for callback in callbacks:
+                    callback()
+                self.kick()
+        self.root.after(int(scaled(idle_check_interval) * 1000), self.check)
+
+
+class EventLoop:
+    # Just enough of Tk's after() and mainloop() to run a FetchScheduler
+    # without a display, for the hub. Timers only get added from the loop
+    # itself, so there is no locking.
+
+    def __init__(self):
+        self.timers = []  # heap of (due, sequence, func)
+        self.count = 0
+
+    def after(self, ms, func):
+        self.count += 1
+        heapq.heappush(self.timers, (time.monotonic() + ms / 1000., self.count, func))
+
+    def mainloop(self):
+        while self.timers:
+            due, _, func = heapq.heappop(self.timers)
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                func()
+            except Exception:
+                traceback.print_exc()
+
+
+def hub_keys():
+    # every (provider, location) a hub keeps fresh
+    return ([('weather', weather_region), ('surf', surf_region)] +
+            [('wind', location) for location in wind_locations] + [('news', news_country_code)])
+
+
+class Hub:
+    # Keeps hub_keys() refreshed through the scheduler and publishes each
+    # result under an increasing sequence number. Entries are JSON-encoded
+    # once when published, and a payload is only encoded again (and sent
+    # again) when its version changes, so answering a subscriber is just
+    # joining strings. Subscribers long-poll updates(); the epoch tells them
+    # when the hub restarted and their sequence number means nothing.
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.epoch = '%x' % int(time.time() * 1000)
+        self.seq = 0
+        self.entries = {}  # key -> (seq, seq the payload changed at, version, meta json, payload json)
+        self.changed = threading.Condition()
+        for provider, location in hub_keys():
+            snapshot = scheduler.source.peek(provider, location)
+            if snapshot is not None:
+                self.publish(snapshot)
+            scheduler.watch(provider, location, self.publish,
+                            lambda e, key=(provider, location): print("Error: %s. Cannot update %s %s on the hub." % (e, key[0], key[1])))
+        metrics.gauge('smartmirror_hub', lambda: [({'stat': 'seq'}, self.seq), ({'stat': 'entries'}, len(self.entries))])
+
+    def publish(self, result):
+        key = (result.provider, result.location)
+        entry = self.entries.get(key)
+        if entry is not None and entry[2] == result.version:
+            changed_seq, payload = entry[1], entry[4]
+        else:
+            changed_seq, payload = None, json.dumps(encode_payload(result.data), default=str)
+        with self.changed:
+            self.seq += 1
+            meta = json.dumps({'provider': result.provider, 'location': result.location, 'version': result.version,
+                               'fetched_at': result.fetched_at, 'seq': self.seq})
+            self.entries[key] = (self.seq, changed_seq or self.seq, result.version, meta, payload)
+            self.changed.notify_all()
+
+    def updates(self, since=0, epoch=None, wait=0):
+        # entries published after since, waiting up to wait seconds for one;
+        # payloads are left out where the subscriber already has that version
+        deadline = time.monotonic() + wait
+        with self.changed:
+            if epoch != self.epoch or since > self.seq:
+                since = 0
+            while self.seq <= since and time.monotonic() < deadline:
+                self.changed.wait(deadline - time.monotonic())
+            parts = []
+            for seq, changed_seq, _, meta, payload in self.entries.values():
+                if seq > since:
+                    parts.append('{"meta": %s, "payload": %s}' % (meta, payload) if changed_seq > since
+                                 else '{"meta": %s}' % meta)
+            return '{"epoch": "%s", "seq": %i, "entries": [%s]}' % (self.epoch, self.seq, ', '.join(parts))
+
+    def snapshot(self, provider, location):
+        with self.changed:
+            entry = self.entries.get((provider, location))
+        if entry is None:
+            return None
+        return '{"meta": %s, "payload": %s}' % (entry[3], entry[4])
+
+
+class HubHandler(http.server.BaseHTTPRequestHandler):
+    #   GET /updates?since=<seq>&epoch=<epoch>&wait=<seconds>
+    #   GET /snapshot?provider=<provider>&location=<location>
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        hub = self.server.hub
+        try:
+            if url.path == '/updates':
+                wait = min(float(query.get('wait', 0)), hub_poll_wait)
+                body = hub.updates(int(query.get('since', 0)), query.get('epoch'), wait)
+            elif url.path == '/snapshot':
+                body = hub.snapshot(query.get('provider'), query.get('location'))
+                if body is None:
+                    self.send_error(404, 'Not on this hub')
+                    return
+            else:
+                self.send_error(404)
+                return
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
+
+        body = body.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        if len(body) > 1024 and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body, compresslevel=5)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_hub_server(hub, address=None):
+    address = hub_address if address is None else address
+    server = http.server.ThreadingHTTPServer(address, HubHandler)
+    server.daemon_threads = True
+    server.hub = hub
+    threading.Thread(target=server.serve_forever, name='hub', daemon=True).start()
+    return server
+
+
+def run_hub():
+    loop = EventLoop()
+    source = DataSource()
+    scheduler = FetchScheduler(loop, source)
+    hub = Hub(scheduler)
+    server = start_hub_server(hub)
+    print('Hub serving %i feeds on %s:%s' % (len(hub_keys()), server.server_address[0], server.server_address[1]))
+    LoopLagMonitor(loop)
+    start_metrics_server()
+    try:
+        loop.mainloop()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        scheduler.close()
+        source.close()
+
+
+class HubSource(DataSource):
+    # DataSource of a mirror subscribed to a hub: results come from the hub
+    # (see HubScheduler) and go into the cache and snapshots as usual, and
+    # the scrapers are never called.
+
+    def __init__(self, url=None, **kwargs):
+        DataSource.__init__(self, **kwargs)
+        self.url = (hub_url if url is None else url).rstrip('/')
+
+    def request(self, path, params, wait=0):
+        response = self.http.session.get(self.url + path, params=params, timeout=wait + self.http.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def fetch(self, provider, location):
+        if provider in local_providers:
+            return DataSource.fetch(self, provider, location)
+        self.requests.setdefault(provider, deque(maxlen=1000)).append(time.time())
+        with metrics.timer('smartmirror_fetch_seconds', provider=provider):
+            entry = self.request('/snapshot', {'provider': provider, 'location': location})
+        return self.received(entry)
+
+    def received(self, entry):
+        meta = entry['meta']
+        provider, location = meta['provider'], meta['location']
+        if 'payload' in entry:
+            data = decode_payload(entry['payload'])
+        else:
+            # same version as before; only fetched_at moved on
+            previous = self.peek(provider, location)
+            if previous is None or previous.version != meta['version']:
+                return self.fetch(provider, location)
+            data = previous.data
+        result = ProviderResult(provider, location, data, meta['fetched_at'], meta['version'])
+        self.cache.put(provider, location, result)
+        self.snapshots.save(result)
+        self.history.record_result(result)
+        return result
+
+    def updates(self, since, epoch, wait=hub_poll_wait):
+        # blocks until the hub has something newer than since, or wait is up
+        reply = self.request('/updates', {'since': since, 'epoch': epoch or '', 'wait': wait}, wait)
+        return reply['seq'], reply['epoch'], [self.received(entry) for entry in reply['entries']]
+
+
+class HubScheduler(FetchScheduler):
+    # FetchScheduler of a mirror fed by a hub. Watched keys do not get
+    # refresh loops of their own: one thread long-polls the hub and every
+    # result it publishes is handed to the watchers on the Tk thread.
+
+    def __init__(self, root, source, **kwargs):
+        self.updates = queue.Queue()
+        FetchScheduler.__init__(self, root, source, **kwargs)
+        self.running = True
+        threading.Thread(target=self._subscribe, name='hub', daemon=True).start()
+        self._arm()
+
+    def watch(self, provider, location, callback, errback=None):
+        if provider in local_providers:
+            return FetchScheduler.watch(self, provider, location, callback, errback)
+        key = (provider, location)
+        watch = self.watches.get(key)
+        if watch is None:
+            watch = self.watches[key] = Watch(provider, location, self.policies[provider])
+        watch.listeners.append((callback, errback))
+
+    def _subscribe(self):
+        seq, epoch, retry = 0, None, hub_retry[0]
+        while self.running:
+            try:
+                seq, epoch, results = self.source.updates(seq, epoch)
+            except Exception as e:
+                self.updates.put((False, e))
+                print("Error: %s. Cannot reach hub %s, retrying in %is." % (e, self.source.url, retry))
+                time.sleep(retry)
+                retry = min(retry * 2, hub_retry[1])
+                continue
+            retry = hub_retry[0]
+            for result in results:
+                self.updates.put((True, result))
+
+    def _drain(self):
+        while True:
+            try:
+                ok, value = self.updates.get_nowait()
+            except queue.Empty:
+                break
+            keys = [(value.provider, value.location)] if ok else list(self.watches)
+            for key in keys:
+                watch = self.watches.get(key)
+                for callback, errback in (watch.listeners if watch is not None else []):
+                    self._deliver(callback, errback, ok, value, key)
+        FetchScheduler._drain(self)
+        # the subscription thread has no way into the Tk loop, so keep polling
+        idle = self.render is not None and self.render.idle
+        self._arm(idle_hub_poll_ms if idle else None)
+
+    def close(self):
+        self.running = False
+        FetchScheduler.close(self)
+
+
+class AgeLabel(Label):
+    # Tells how old a panel's data is once it is past stale_after, so a panel
+    # running on a snapshot says so instead of showing an error.
+
+    def __init__(self, parent):
+        Label.__init__(self, parent, font=('Helvetica', small_text_size), fg="gray", bg="black", **FRAME_DEBUG)
+        self.text = ''
+
+    def show(self, result):
+        text = ''
+        if result is not None and result.age > stale_after.get(result.provider, 0):
+            text = 'Updated %s' % format_age(result.age)
+        if text != self.text:
+            self.text = text
+            self.config(text=text)
+
+
+class TrendLabel(Label):
+    # "+4.2 mph vs yesterday" for a history series, once there is a point
+    # from about a day ago to compare with.
+
+    def __init__(self, parent, history):
+        Label.__init__(self, parent, font=('Helvetica', small_text_size), fg="gray", bg="black", **FRAME_DEBUG)
+        self.history = history
+        self.text = ''
+
+    def show(self, series):
+        text = ''
+        change = None if self.history is None else self.history.trends.get(series)
+        if change is not None:
+            text = '%+.1f %s vs yesterday' % (change, history_units.get(series.split('/')[0], ''))
+        if text != self.text:
+            self.text = text
+            self.config(text=text)
+
+
+def time_axis(frame):
+    # the DataFrame's timestamps, from its index or its first datetime column
+    import numpy as np
+    if hasattr(frame.index, 'normalize'):
+        return frame.index
+    for column in frame.columns:
+        if np.issubdtype(frame[column].dtype, np.datetime64):
+            return frame[column]
+    return None
+
+
+def day_ticks(times):
+    # tick at the first sample of each day, labelled with the weekday
+    import numpy as np
+    days = np.asarray(times, dtype='datetime64[D]')
+    starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+    return starts, [days[i].astype(object).strftime('%a') for i in starts]
+
+
+class ForecastPlot:
+    # Forecast figure whose artists are made once. Updates move the existing
+    # lines with set_data, only touch tick labels that changed, and ask for an
+    # idle redraw instead of clearing and restyling the axes every refresh.
+
+    live = weakref.WeakSet()  # every plot still around, for the memory guard
+
+    def __init__(self, parent, title=None, figsize=(5, 3), title_size=12, name='plot'):
+        self.parent = parent
+        self.name = name
+        self.figsize = figsize
+        self.title_size = title_size
+        self.styles = {}
+        self.build(title)
+        ForecastPlot.live.add(self)
+
+    def build(self, title):
+        from matplotlib.figure import Figure
+        self.fig = Figure(figsize=self.figsize, facecolor='black')
+        self.ax = self.fig.add_subplot(111)
+        ax = self.ax
+        ax.patch.set_facecolor('black')
+        ax.spines['bottom'].set_color('white')
+        ax.spines['left'].set_color('white')
+        ax.tick_params(axis='x', colors='white')
+        ax.tick_params(axis='y', colors='white')
+
+        self.title = None
+        self.set_title(title)
+        self.lines = {}
+        self.xticks = None
+        self.yticks = None
+        self.laid_out = False
+
+        self.canvas = self.make_canvas(self.parent)
+
+    def rebuild(self):
+        # Swap in a new figure and canvas showing the same thing, leaving
+        # behind whatever matplotlib has piled up on the old ones
+        lines = [(name, line.get_xdata(), line.get_ydata()) for name, line in self.lines.items()]
+        title, xticks, yticks = self.title, self.xticks, self.yticks
+        if hasattr(self.canvas, 'get_tk_widget'):
+            self.canvas.get_tk_widget().destroy()
+        self.fig.clear()
+        self.build(title)
+        for name, x, y in lines:
+            self.set_line(name, x, y, **self.styles[name])
+        if xticks is not None:
+            self.set_xticks(*xticks)
+        if yticks is not None:
+            self.set_yticks(yticks)
+        if lines:
+            self.draw()
+
+    def make_canvas(self, parent):
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        canvas = FigureCanvasTkAgg(self.fig, parent)
+        canvas.get_tk_widget().pack(side=BOTTOM, fill=BOTH, expand=True)
+
+        # draw_idle() ends up here too, so every real render is timed
+        draw = canvas.draw
+
+        def timed_draw(*args, **kwargs):
+            with metrics.timer('smartmirror_canvas_draw_seconds', panel=self.name):
+                return draw(*args, **kwargs)
+        canvas.draw = timed_draw
+        return canvas
+
+    def set_title(self, title):
+        if title != self.title:
+            self.title = title
+            self.ax.set_title(title or '', color='white', fontsize=self.title_size)
+
+    def set_line(self, name, x, y, **style):
+        line = self.lines.get(name)
+        if line is None:
+            self.styles[name] = style
+            self.lines[name], = self.ax.plot(x, y, color='white', markeredgecolor='white', **style)
+        else:
+            line.set_data(x, y)
+
+    def set_xticks(self, ticks, labels, rotation=0):
+        key = (tuple(ticks), tuple(labels), rotation)
+        if key != self.xticks:
+            self.xticks = key
+            self.ax.set_xticks(ticks)
+            self.ax.set_xticklabels(labels, rotation=rotation)
+
+    def set_yticks(self, ticks):
+        key = tuple(ticks)
+        if key != self.yticks:
+            self.yticks = key
+            self.ax.set_yticks(ticks)
+            self.ax.set_yticklabels(ticks)
+
+    def draw(self):
+        self.ax.relim()
+        self.ax.autoscale_view()
+        if not self.laid_out:
+            self.fig.tight_layout()
+            self.laid_out = True
+        self.canvas.draw_idle()
+
+
+class SparkPlot:
+    # Lightweight stand-in for ForecastPlot drawing straight onto a Tk
+    # Canvas: one line item per series plus pooled text items for title and
+    # tick labels, all moved in place on each update. Data is scaled to
+    # pixels with numpy in one pass. No antialiasing or tick placement of
+    # its own, but no matplotlib either.
+
+    dpi = 100
+    tick_font = ('Helvetica', 8)
+    dashes = {'--': (6, 4), ':': (2, 3), '-.': (6, 3, 2, 3)}
+
+    def __init__(self, parent, title=None, figsize=(5, 3), title_size=12, name='plot'):
+        self.name = name
+        self.width = int(figsize[0] * self.dpi)
+        self.height = int(figsize[1] * self.dpi)
+        self.title_size = title_size
+        self.canvas = Canvas(parent, width=self.width, height=self.height, bg='black', highlightthickness=0)
+        self.canvas.pack(side=BOTTOM)
+        self.title_item = self.canvas.create_text(self.width / 2, 4, anchor=N, fill='white',
+                                                  font=('Helvetica', title_size))
+        self.axes_item = self.canvas.create_line(0, 0, 0, 0, fill='white')
+        self.title = None
+        self.set_title(title)
+        self.lines = {}  # name -> (canvas item, x, y)
+        self.xticks = None
+        self.yticks = None
+        self.labels = []  # pooled tick label items
+
+    def set_title(self, title):
+        if title != self.title:
+            self.title = title
+            self.canvas.itemconfigure(self.title_item, text=title or '')
+
+    def set_line(self, name, x, y, **style):
+        import numpy as np
+        line = self.lines.get(name)
+        if line is None:
+            item = self.canvas.create_line(0, 0, 0, 0, fill='white', width=style.get('linewidth', 1),
+                                           dash=self.dashes.get(style.get('linestyle'), ''))
+        else:
+            item = line[0]
+        self.lines[name] = (item, np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+
+    def set_xticks(self, ticks, labels, rotation=0):
+        self.xticks = (tuple(ticks), tuple(labels), rotation)
+
+    def set_yticks(self, ticks):
+        self.yticks = tuple(ticks)
+
+    def box(self):
+        # left, top, right, bottom of the plotting area in pixels
+        top = self.title_size * 2 + 4 if self.title else 10
+        bottom = self.height - (45 if self.xticks and self.xticks[2] else 20)
+        return 40, top, self.width - 10, bottom
+
+    def label(self, idx, x, y, text, anchor, angle=0):
+        if idx == len(self.labels):
+            self.labels.append(self.canvas.create_text(0, 0, fill='white', font=self.tick_font))
+        item = self.labels[idx]
+        self.canvas.coords(item, x, y)
+        self.canvas.itemconfigure(item, text=text, anchor=anchor, angle=angle, state=NORMAL)
+
+    def draw(self):
+        import numpy as np
+        if not self.lines:
+            return
+        xs = np.concatenate([x for _, x, _ in self.lines.values()])
+        ys = np.concatenate([y for _, _, y in self.lines.values()])
+        finite = np.isfinite(xs) & np.isfinite(ys)
+        if not finite.any():
+            return
+        # data limits with the same 5% margins as matplotlib's autoscale
+        x0, x1 = xs[finite].min(), xs[finite].max()
+        y0, y1 = ys[finite].min(), ys[finite].max()
+        xpad, ypad = (x1 - x0) * 0.05 or 0.5, (y1 - y0) * 0.05 or 0.5
+        x0, x1, y0, y1 = x0 - xpad, x1 + xpad, y0 - ypad, y1 + ypad
+        left, top, right, bottom = self.box()
+        to_px = lambda x: left + (x - x0) * ((right - left) / (x1 - x0))
+        to_py = lambda y: bottom - (y - y0) * ((bottom - top) / (y1 - y0))
+
+        for item, x, y in self.lines.values():
+            keep = np.isfinite(x) & np.isfinite(y)
+            if keep.sum() < 2:
+                self.canvas.itemconfigure(item, state=HIDDEN)
+                continue
+            points = np.empty(2 * keep.sum())
+            points[0::2] = to_px(x[keep])
+            points[1::2] = to_py(y[keep])
+            self.canvas.coords(item, points.tolist())
+            self.canvas.itemconfigure(item, state=NORMAL)
+        self.canvas.coords(self.axes_item, left, top, left, bottom, right, bottom)
+
+        idx = 0
+        if self.xticks is not None:
+            ticks, labels, rotation = self.xticks
+            ticks = np.asarray(ticks, dtype=float)
+            shown = (ticks >= x0) & (ticks <= x1)
+            anchor = NE if rotation else N
+            for px, text in zip(to_px(ticks[shown]), np.asarray(labels, dtype=object)[shown]):
+                self.label(idx, px, bottom + 4, text, anchor, rotation)
+                idx += 1
+        if self.yticks is not None:
+            ticks = np.asarray(self.yticks, dtype=float)
+            ticks = ticks[(ticks >= y0) & (ticks <= y1)]
+            for py, tick in zip(to_py(ticks), ticks):
+                self.label(idx, left - 4, py, '%g' % tick, E)
+                idx += 1
+        for item in self.labels[idx:]:
+            self.canvas.itemconfigure(item, state=HIDDEN)
+
+
+plot_classes = {'matplotlib': ForecastPlot, 'spark': SparkPlot}
+
+
+def make_plot(panel, parent, title=None, **kwargs):
+    renderer = plot_renderers.get(panel, 'matplotlib')
+    if renderer not in plot_classes:
+        print("Warning: unknown plot renderer %s for %s, using matplotlib" % (renderer, panel))
+        renderer = 'matplotlib'
+    return plot_classes[renderer](parent, title, **kwargs)
+
+
+def panel_imports(panel):
+    # a panel drawn with SparkPlot has no use for matplotlib
+    names = panel_modules.get(panel, [])
+    if plot_renderers.get(panel) == 'spark':
+        names = [name for name in names if not name.startswith('matplotlib')]
+    return names
+
+
+def draw_weather_forecast(plot, forecast):
+    import numpy as np
+    with metrics.timer('smartmirror_plot_update_seconds', panel=plot.name):
+        forecast = plot_forecast(forecast)
+        x = np.arange(len(forecast))
+        plot.set_line('max', x, forecast['max'], linewidth=1, markersize=6, linestyle='--')
+        plot.set_line('ave', x, forecast['mean'], linewidth=2, markersize=6)
+        plot.set_line('min', x, forecast['min'], linewidth=1, markersize=6, linestyle='--')
+
+        # Set ticks and tick labels
+        plot.set_xticks(x, forecast.labels, rotation=45)
+        plot.set_yticks(np.arange(np.floor(np.min(forecast['min'])), np.max(forecast['max']), 5).astype(int))
+        plot.draw()
+
+
+def draw_surf_forecast(plot, forecast):
+    import numpy as np
+    with metrics.timer('smartmirror_plot_update_seconds', panel=plot.name):
+        forecast = plot_forecast(forecast)
+        plot.set_line('height', np.arange(len(forecast)), forecast['height'], linewidth=2)
+        if forecast.timed:
+            plot.set_xticks(*day_ticks(forecast.times))
+        plot.draw()
+
+
+def draw_wind_forecast(plot, forecast, title=None):
+    import numpy as np
+    with metrics.timer('smartmirror_plot_update_seconds', panel=plot.name):
+        forecast = plot_forecast(forecast)
+        if title is not None:
+            plot.set_title(title)
+        plot.set_line('speed', np.arange(len(forecast)), forecast['speed'], linewidth=2)
+        if forecast.timed:
+            plot.set_xticks(*day_ticks(forecast.times))
+        plot.draw()
+
+
+class LocaleFormatter:
+    # strftime for one locale without switching the process locale on every
+    # call. Day, month and AM/PM names are read once under setlocale() and
+    # substituted from then on; the remaining directives are numeric and do
+    # not depend on the locale.
+
+    def __init__(self, name):
+        self.name = name
+        with setlocale(name):
+            # 2024-01-01 was a Monday, which is tm_wday 0
+            days = [time.localtime(time.mktime((2024, 1, 1 + day, 12, 0, 0, 0, 0, -1))) for day in range(7)]
+            months = [time.localtime(time.mktime((2024, month, 1, 12, 0, 0, 0, 0, -1))) for month in range(1, 13)]
+            halves = [time.localtime(time.mktime((2024, 1, 1, hour, 0, 0, 0, 0, -1))) for hour in (0, 12)]
+            self.names = {
+                'A': [time.strftime('%A', t) for t in days],
+                'a': [time.strftime('%a', t) for t in days],
+                'B': [time.strftime('%B', t) for t in months],
+                'b': [time.strftime('%b', t) for t in months],
+                'p': [time.strftime('%p', t) for t in halves],
+            }
+        self.names['h'] = self.names['b']
+
+    def _directive(self, match, t):
+        code = match.group(1)
+        if code in ('A', 'a'):
+            return self.names[code][t.tm_wday]
+        if code in ('B', 'b', 'h'):
+            return self.names[code][t.tm_mon - 1]
+        if code == 'p':
+            return self.names['p'][t.tm_hour >= 12]
+        if code in ('c', 'x', 'X', 'r'):
+            # composite locale formats are rare enough to pay for setlocale
+            with setlocale(self.name):
+                return time.strftime(match.group(0), t)
+        return time.strftime(match.group(0), t)
+
+    def format(self, fmt, t):
+        return re.sub(r'%(.)', lambda match: self._directive(match, t), fmt)
+
+
 class Clock(Frame):
     def __init__(self, parent, *args, **kwargs):
         Frame.__init__(self, parent, bg='black')
+        self.formatter = LocaleFormatter(ui_locale)
 
         # initialize time label
         self.time1 = ''
@@ -91,162 +2709,186 @@ class Clock(Frame):
 
         # initialize date label
         self.date1 = ''
+        self.day1 = None
         self.dateLbl = Label(self, text=self.date1, font=('Helvetica', small_text_size), fg="white", bg="black", **FRAME_DEBUG)
         self.dateLbl.pack(side=TOP, anchor=E)
         self.tick()
 
     def tick(self):
-        with setlocale(ui_locale):
-            if time_format == 12:
-                time2 = time.strftime('%I:%M %p') #hour in 12h format
-            else:
-                time2 = time.strftime('%H:%M') #hour in 24h format
-
-            day_of_week2 = time.strftime('%A')
-            date2 = time.strftime(date_format)
-            # if time string has changed, update it
-            if time2 != self.time1:
-                self.time1 = time2
-                self.timeLbl.config(text=time2)
+        now = time.time()
+        t = time.localtime(now)
+        if time_format == 12:
+            time2 = self.formatter.format('%I:%M %p', t) #hour in 12h format
+        else:
+            time2 = self.formatter.format('%H:%M', t) #hour in 24h format
+        if time2 != self.time1:
+            self.time1 = time2
+            self.timeLbl.config(text=time2)
+
+        # the date labels are only formatted again once the day changes;
+        # checking here instead of on a midnight timer also copes with the
+        # clock jumping when a Pi without an RTC gets its time from NTP
+        day2 = (t.tm_year, t.tm_yday)
+        if day2 != self.day1:
+            self.day1 = day2
+            day_of_week2 = self.formatter.format('%A', t)
+            date2 = self.formatter.format(date_format, t)
             if day_of_week2 != self.day_of_week1:
                 self.day_of_week1 = day_of_week2
                 self.dayOWLbl.config(text=day_of_week2)
             if date2 != self.date1:
                 self.date1 = date2
                 self.dateLbl.config(text=date2)
-            # calls itself every 200 milliseconds
-            # to update the time display as needed
-            # could use >200 ms, but display gets jerky
-            self.timeLbl.after(1000, self.tick)
+
+        # the display only changes on the minute, so sleep until just after
+        # the next one starts
+        self.timeLbl.after(int((60 - now % 60) * 1000) + 20, self.tick)
 
 
 class Surf(Frame):
-    def __init__(self, parent, *args, **kwargs):
+    def __init__(self, parent, scheduler, *args, **kwargs):
         Frame.__init__(self, parent, bg='black', **FRAME_DEBUG)
-        self.surfline = SurflineScraper()
+        self.scheduler = scheduler
         self.temperature = ''
         self.icon = ''
         
         # Initialize variables to later be updated
-        self.dummy_x = None
-        self.x_ticks = None
-        self.ax = None
-        self.canvas = None
-        self.fig = None
+        self.plot = None
         
         # Plot future Data
         self.plot_frame = Frame(self, bg="black", **FRAME_DEBUG)
         self.plot_frame.pack(side=TOP, anchor=W)
-        self.surf_data = None
-        self.MakeForecastPlot()
-    
-    def MakeForecastPlot(self):
-        print('Making Surf Forecast')
-        first_time = self.canvas is None
-                
-        surf_data = self.surfline.GetData(surf_region)
-        
-        if not first_time:
-            if np.average(surf_data['Wave Avg Height [ft]'].values) == np.average(self.surf_data['Wave Avg Height [ft]'].values):
-                self.after(10000, self.MakeForecastPlot)
-                return
-        
-        self.surf_data = surf_data
-        
-        if first_time:
-            self.fig = plt.figure(figsize=(5, 3), facecolor='black')
-        else:
-            self.fig.gca().clear()
-
-        plt.figure(self.fig.number)
-        self.surfline.PlotSurfResults(surf_region)
-        
-        self.ax = self.fig.gca()
-        ax = self.ax
-        ax.patch.set_facecolor('black')
-
-        ax.spines['bottom'].set_color('white')
-        ax.spines['left'].set_color('white')
-        ax.tick_params(axis='x', colors='white')
-        ax.tick_params(axis='y', colors='white')
-        
-        if first_time:
-            plt.tight_layout()
-            self.canvas = FigureCanvasTkAgg(self.fig, self.plot_frame)
-            self.canvas.get_tk_widget().pack(side=BOTTOM, fill=BOTH,
-                                             expand=True)
-        
-        self.canvas.draw()
-        self.after(200000, self.MakeForecastPlot)
+        self.ageLbl = AgeLabel(self)
+        self.ageLbl.pack(side=TOP, anchor=W)
+        self.trendLbl = TrendLabel(self, scheduler.source.history)
+        self.trendLbl.pack(side=TOP, anchor=W)
+        self.result = None
+        self.version = None
+
+        # draw the last snapshot right away, then refresh in the background
+        snapshot = scheduler.source.peek('surf', surf_region)
+        if snapshot is not None:
+            self.UpdateForecastPlot(snapshot)
+        scheduler.watch('surf', surf_region, self.UpdateForecastPlot, self.FetchFailed)
+
+    def FetchFailed(self, e):
+        print("Error: %s. Cannot get surf forecast." % e)
+        self.ageLbl.show(self.result)
+
+    def UpdateForecastPlot(self, result):
+        # cheap path: only redraws when the data changed
+        self.result = result
+        self.ageLbl.show(result)
+        self.trendLbl.show('surf.height/%s' % surf_region)
+        if result.version == self.version:
+            return False
+
+        self.version = result.version
+
+        if self.plot is None:
+            self.plot = make_plot('surf', self.plot_frame, 'Surf Forecast [%s]' % display_unit('ft'), name='surf')
+        draw_surf_forecast(self.plot, result.forecast)
+        return True
 
 
 class Wind(Frame):
-    def __init__(self, parent, *args, **kwargs):
+    def __init__(self, parent, scheduler, *args, **kwargs):
         Frame.__init__(self, parent, bg='black', **FRAME_DEBUG)
-        self.iwindsurf = iWindsurfScraper()
+        self.scheduler = scheduler
         self.temperature = ''
         self.icon = ''
         
         # Initialize variables to later be updated
-        self.dummy_x = None
-        self.x_ticks = None
-        self.ax = None
-        self.canvas = None
-        self.fig = None
+        self.plot = None
+        self.plots = {}
+        self.versions = {}
         
         # Plot future Data
         self.plot_frame = Frame(self, bg="black", **FRAME_DEBUG)
         self.plot_frame.pack(side=TOP, anchor=W)
-        self.wind_data = None
+        self.ageLbl = AgeLabel(self)
+        self.ageLbl.pack(side=TOP, anchor=W)
+        self.trendLbl = TrendLabel(self, scheduler.source.history)
+        self.trendLbl.pack(side=TOP, anchor=W)
+        self.result = None
+        self.results = {}
         self.wind_loc_index = 0
-        self.MakeForecastPlot()
-    
-    def MakeForecastPlot(self):
-        print('Making WindSurf Forecast')
-        first_time = self.canvas is None
-        location_idx = self.wind_loc_index
-        location = wind_locations[location_idx]
-        wind_data = self.iwindsurf.GetData(location)
-        
-        if not first_time:
-            if np.average(wind_data['Wind Speed [mph]'].values) == np.average(self.wind_data['Wind Speed [mph]'].values):
-                self.after(10000, self.MakeForecastPlot)
-                return
 
-        self.wind_data = wind_data
-        
-        if first_time:
-            self.fig = plt.figure(figsize=(5, 3), facecolor='black')
+        # draw the last snapshots right away, then refresh in the background
+        for location in wind_locations:
+            snapshot = scheduler.source.peek('wind', location)
+            if snapshot is not None:
+                self.ForecastReceived(snapshot)
+
+        # every location is prefetched at once and kept fresh on the pool,
+        # so rotating the display never has to wait on the scraper
+        for location in wind_locations:
+            scheduler.watch('wind', location, self.ForecastReceived, self.FetchFailed)
+        if not wind_small_multiples and len(wind_locations) > 1:
+            self.after(int(scaled(wind_rotate_interval) * 1000), self.Rotate)
+
+    def Rotate(self):
+        # move on to the next location that already has data
+        for _ in wind_locations:
+            self.wind_loc_index = (self.wind_loc_index + 1) % len(wind_locations)
+            result = self.results.get(wind_locations[self.wind_loc_index])
+            if result is not None:
+                self.scheduler.update(('rotate', id(self)), self.UpdateForecastPlot, result)
+                break
+        self.after(int(scaled(wind_rotate_interval) * 1000), self.Rotate)
+
+    def FetchFailed(self, e):
+        print("Error: %s. Cannot get wind forecast." % e)
+        self.ageLbl.show(self.result)
+
+    def ForecastReceived(self, result):
+        self.results[result.location] = result
+        if wind_small_multiples or result.location == wind_locations[self.wind_loc_index]:
+            self.UpdateForecastPlot(result)
+
+    def GetPlot(self, location):
+        if not wind_small_multiples:
+            if self.plot is None:
+                self.plot = make_plot('wind', self.plot_frame, name='wind')
+            return self.plot
+
+        plot = self.plots.get(location)
+        if plot is None:
+            idx = wind_locations.index(location)
+            cell = Frame(self.plot_frame, bg="black", **FRAME_DEBUG)
+            cell.grid(row=idx // 2, column=idx % 2)
+            plot = self.plots[location] = make_plot('wind', cell, location.title(), figsize=(2.5, 1.5),
+                                                  title_size=8, name='wind %s' % location)
+        return plot
+
+    def UpdateForecastPlot(self, result):
+        # cheap path: only redraws when the data changed
+        location = result.location
+        if wind_small_multiples:
+            # the panel is as stale as its oldest spot
+            self.result = min(self.results.values(), key=lambda r: r.fetched_at)
         else:
-            self.fig.gca().clear()
+            self.result = result
+            self.trendLbl.show('wind.speed/%s' % location)
+        self.ageLbl.show(self.result)
 
-        plt.figure(self.fig.number)
-        self.iwindsurf.PlotWindForecast(location)
-        
-        self.ax = self.fig.gca()
-        ax = self.ax
-        ax.patch.set_facecolor('black')
+        plot = self.GetPlot(location)
+        if self.versions.get(plot) == result.version:
+            return False
 
-        ax.spines['bottom'].set_color('white')
-        ax.spines['left'].set_color('white')
-        ax.tick_params(axis='x', colors='white')
-        ax.tick_params(axis='y', colors='white')    
-        
-        if first_time:
-            plt.tight_layout()
-            self.canvas = FigureCanvasTkAgg(self.fig, self.plot_frame)
-            self.canvas.get_tk_widget().pack(side=BOTTOM, fill=BOTH,
-                                             expand=True)
-        
-        self.canvas.draw()
-        self.wind_loc_index = np.remainder(self.wind_loc_index + 1, len(wind_locations))
-        self.after(200000, self.MakeForecastPlot)
+        self.versions[plot] = result.version
+
+        title = None if wind_small_multiples else 'Wind Forecast [%s] - %s' % (display_unit('mph'), location.title())
+        draw_wind_forecast(plot, result.forecast, title)
+        return True
 
 
 class Weather(Frame):
-    def __init__(self, parent, *args, **kwargs):
+    def __init__(self, parent, scheduler, *args, **kwargs):
         Frame.__init__(self, parent, bg='black', **FRAME_DEBUG)
-        self.google_weather = GoogleWeatherAPI()
+        self.scheduler = scheduler
+        # decode every weather icon once, up front
+        image_cache.preload(set(icon_lookup.values()), weather_icon_size)
         self.temperature = ''
         self.forecast = ''
         self.location = ''
@@ -255,16 +2897,9 @@ class Weather(Frame):
         
         # Initialize variables to later be updated
         self.weather_data = None
-        self.dummy_x = None
-        self.x_ticks = None
-        self.ax = None
-        self.canvas = None
-        self.fig = None
-
-        # Weather debug
-        # self.weather_data = np.array([10, 10, 11, 11, 12, 9, 8, 8])
-        # self.weekdays = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday',
-        #                  'Saturday', 'Sunday', 'Monday']
+        self.weather_version = None
+        self.forecast_version = None
+        self.plot = None
 
         self.temperatureLbl = Label(self, font=('Helvetica', xlarge_text_size), fg="white", bg="black", **FRAME_DEBUG)
         self.temperatureLbl.pack(side=TOP, anchor=W)
@@ -283,83 +2918,54 @@ class Weather(Frame):
         
         self.locationLbl = Label(self, font=('Helvetica', small_text_size), fg="white", bg="black", **FRAME_DEBUG)
         self.locationLbl.pack(side=TOP, anchor=W)
-        self.get_weather()
+
+        self.ageLbl = AgeLabel(self)
+        self.ageLbl.pack(side=TOP, anchor=W)
+        self.trendLbl = TrendLabel(self, scheduler.source.history)
+        self.trendLbl.pack(side=TOP, anchor=W)
+        self.result = None
 
         # Plot future Data
         self.plot_frame = Frame(self, bg="black", **FRAME_DEBUG)
         self.plot_frame.pack(side=TOP, anchor=W)
-        self.MakeForecastPlot()
 
-    def MakeForecastPlot(self):
-        
-        first_time = self.canvas is None
-    
-        self.dummy_x = np.arange(0, 8, 1)
-
-        weather_data = self.google_weather.GetDataFromRegion(weather_region)
-        # weather_data = np.append(self.weather_data[1:], self.weather_data[0])
-        # self.weekdays = self.weekdays[1:] + [self.weekdays[0]]
-        if not (weather_data == self.weather_data):
-        # if True:
-    
-            self.weather_data = weather_data
-        
-            min_temp = []
-            max_temp = []
-            ave_temp = []
-            weekdays = []
-            for dayweather in weather_data['next_days']:
-                min_temp += [dayweather['min_temp_c']]
-                max_temp += [dayweather['max_temp_c']]
-                ave_temp += [(max_temp[-1] + min_temp[-1]) / 2]
-                weekdays += [dayweather['name']]
-            
-            # for idx, num in enumerate(self.weather_data):
-            #     min_temp += [num-1]
-            #     max_temp += [num+1]
-            #     ave_temp += [num]
-            #     weekdays += [self.weekdays[idx]]
-            
-            if first_time:
-                self.fig = plt.figure(figsize=(5, 3), facecolor='black')
-            else:
-                self.fig.gca().clear()
-
-            plt.figure(self.fig.number)
-    
-            plt.plot(self.dummy_x, max_temp, linewidth=1, markersize=6, color='white', markeredgecolor='white', linestyle='--')
-            plt.plot(self.dummy_x, ave_temp, linewidth=2, markersize=6, color='white', markeredgecolor='white')
-            plt.plot(self.dummy_x, min_temp, linewidth=1, markersize=6, color='white', markeredgecolor='white', linestyle='--')
-            
-            self.ax = self.fig.gca()
-            ax = self.ax
-            ax.patch.set_facecolor('black')
-            
-            # Set ticks and tick labels
-            y_ticks = np.arange(np.min(min_temp), np.max(max_temp), 5)
-            plt.xticks(self.dummy_x, weekdays, rotation=45)
-            plt.yticks(y_ticks, y_ticks)
-            
-            ax.spines['bottom'].set_color('white')
-            ax.spines['left'].set_color('white')
-            ax.tick_params(axis='x', colors='white')
-            ax.tick_params(axis='y', colors='white')
-            
-            if first_time:
-                plt.title('Temperature Forecast [degC]', color='white', fontsize=12)
-                plt.tight_layout()
-                self.canvas = FigureCanvasTkAgg(self.fig, self.plot_frame)
-                self.canvas.get_tk_widget().pack(side=BOTTOM, fill=BOTH, expand=True)
-              
-            self.canvas.draw()
-        
-        self.after(200000, self.MakeForecastPlot)
-
-    def get_weather(self):
+        # draw the last snapshot right away, then refresh in the background
+        snapshot = scheduler.source.peek('weather', weather_region)
+        if snapshot is not None:
+            self.update_weather(snapshot)
+            self.UpdateForecastPlot(snapshot)
+        scheduler.watch('weather', weather_region, self.weather_received, self.weather_failed)
+
+    def UpdateForecastPlot(self, result):
+        # cheap path: only redraws when the data changed
+        if result.version == self.forecast_version:
+            return False
+        self.forecast_version = result.version
+        self.weather_data = result.data
+
+        if self.plot is None:
+            self.plot = make_plot('weather', self.plot_frame, 'Temperature Forecast [%s]' % display_unit('degC'),
+                                  name='weather')
+        draw_weather_forecast(self.plot, result.forecast)
+        return True
+
+    def weather_failed(self, e):
+        print("Error: %s. Cannot get weather." % e)
+        self.ageLbl.show(self.result)
+
+    def weather_received(self, result):
+        self.update_weather(result)
+        self.UpdateForecastPlot(result)
+
+    def update_weather(self, result):
+        self.result = result
+        self.ageLbl.show(result)
+        self.trendLbl.show('weather.temp/%s' % weather_region)
+        if result.version == self.weather_version:
+            return
+        self.weather_version = result.version
         try:
-
-            weather_data = self.google_weather.GetDataFromRegion(weather_region)
-
+            weather_data = result.data
             degree_sign = u'\N{DEGREE SIGN}'
             temperature_c = weather_data['temp_c']
             currently2 = weather_data['weather_now'].title()
@@ -370,15 +2976,12 @@ class Weather(Frame):
             if icon2 is not None:
                 if self.icon != icon2:
                     self.icon = icon2
-                    image = Image.open(icon2)
-                    image = image.resize((30, 30), Image.ANTIALIAS)
-                    image = image.convert('RGB')
-                    photo = ImageTk.PhotoImage(image)
-
+                    photo = image_cache.get(icon2, weather_icon_size)
                     self.iconLbl.config(image=photo)
                     self.iconLbl.image = photo
-            else:
+            elif self.icon != '':
                 # remove image
+                self.icon = ''
                 self.iconLbl.config(image='')
 
             if self.currently != currently2:
@@ -389,7 +2992,7 @@ class Weather(Frame):
                 self.forecastLbl.config(text=forecast2)
             if self.temperature != temperature_c:
                 self.temperature = temperature_c
-                temperature_f = self.google_weather.CelsiusToFarenheit(temperature_c)
+                temperature_f = convert_units(temperature_c, 'degC', 'degF')
                 temperature_string = '%i°C / %i°F' % (temperature_c, temperature_f)
                 self.temperatureLbl.config(text=temperature_string)
             if self.location != weather_region:
@@ -403,51 +3006,66 @@ class Weather(Frame):
             traceback.print_exc()
             print("Error: %s. Cannot get weather." % e)
 
-        self.after(600000, self.get_weather)
-
 
 class News(Frame):
-    def __init__(self, parent, *args, **kwargs):
+    def __init__(self, parent, scheduler, *args, **kwargs):
         Frame.__init__(self, parent, *args, **kwargs)
         self.config(bg='black')
+        self.scheduler = scheduler
         self.title = 'News'  # 'News' is more internationally generic
         self.newsLbl = Label(self, text=self.title, font=('Helvetica', medium_text_size), fg="white", bg="black")
         self.newsLbl.pack(side=TOP, anchor=W)
         self.headlinesContainer = Frame(self, bg="black")
         self.headlinesContainer.pack(side=TOP)
-        self.get_headlines()
 
-    def get_headlines(self):
+        # a fixed pool of headline widgets that get relabelled, never rebuilt
+        self.headlines = [NewsHeadline(self.headlinesContainer) for _ in range(news_headline_count)]
+        self.shown = []
+        self.version = None
+
+        self.ageLbl = AgeLabel(self)
+        self.ageLbl.pack(side=TOP, anchor=W)
+        self.result = None
+
+        # show the last snapshot right away, then refresh in the background
+        snapshot = scheduler.source.peek('news', news_country_code)
+        if snapshot is not None:
+            self.update_headlines(snapshot)
+        scheduler.watch('news', news_country_code, self.update_headlines, self.headlines_failed)
+
+    def headlines_failed(self, e):
+        print("Error: %s. Cannot get news." % e)
+        self.ageLbl.show(self.result)
+
+    def update_headlines(self, result):
+        self.result = result
+        self.ageLbl.show(result)
+        if result.version == self.version:
+            return
+        self.version = result.version
         try:
-            # remove all children
-            for widget in self.headlinesContainer.winfo_children():
-                widget.destroy()
-            if news_country_code == None:
-                headlines_url = "https://news.google.com/news?ned=us&output=rss"
-            else:
-                headlines_url = "https://news.google.com/news?ned=%s&output=rss" % news_country_code
-
-            feed = feedparser.parse(headlines_url)
+            titles = [post['title'] for post in result.data[0:news_headline_count]]
+            if titles == self.shown:
+                return
 
-            for post in feed.entries[0:5]:
-                headline = NewsHeadline(self.headlinesContainer, post.title)
-                headline.pack(side=TOP, anchor=W)
+            for idx, headline in enumerate(self.headlines):
+                if idx < len(titles):
+                    headline.set_event_name(titles[idx])
+                    if idx >= len(self.shown):
+                        headline.pack(side=TOP, anchor=W)
+                elif idx < len(self.shown):
+                    headline.pack_forget()
+            self.shown = titles
         except Exception as e:
             traceback.print_exc()
-            print("Error: %s. Cannot get news.") % e
-
-        self.after(600000, self.get_headlines)
+            print("Error: %s. Cannot get news." % e)
 
 
 class NewsHeadline(Frame):
     def __init__(self, parent, event_name=""):
         Frame.__init__(self, parent, bg='black')
 
-        image = Image.open("assets/Newspaper.png")
-        image = image.resize((25, 25), Image.ANTIALIAS)
-        image = image.convert('RGB')
-        photo = ImageTk.PhotoImage(image)
-
+        photo = image_cache.get(news_icon, news_icon_size)
         self.iconLbl = Label(self, bg='black', image=photo)
         self.iconLbl.image = photo
         self.iconLbl.pack(side=LEFT, anchor=N)
@@ -456,37 +3074,85 @@ class NewsHeadline(Frame):
         self.eventNameLbl = Label(self, text=self.eventName, font=('Helvetica', small_text_size), fg="white", bg="black")
         self.eventNameLbl.pack(side=LEFT, anchor=N)
 
+    def set_event_name(self, event_name):
+        if event_name != self.eventName:
+            self.eventName = event_name
+            self.eventNameLbl.config(text=event_name)
+
 
 class Calendar(Frame):
-    def __init__(self, parent, *args, **kwargs):
+    def __init__(self, parent, scheduler, *args, **kwargs):
         Frame.__init__(self, parent, bg='black')
+        self.scheduler = scheduler
         self.title = 'Calendar Events'
         self.calendarLbl = Label(self, text=self.title, font=('Helvetica', medium_text_size), fg="white", bg="black")
         self.calendarLbl.pack(side=TOP, anchor=E)
         self.calendarEventContainer = Frame(self, bg='black')
         self.calendarEventContainer.pack(side=TOP, anchor=E)
-        self.get_events()
-
-    def get_events(self):
-        #TODO: implement this method
-        # reference https://developers.google.com/google-apps/calendar/quickstart/python
-
-        # remove all children
-        for widget in self.calendarEventContainer.winfo_children():
-            widget.destroy()
-
-        calendar_event = CalendarEvent(self.calendarEventContainer)
-        calendar_event.pack(side=TOP, anchor=E)
-        pass
+        self.formatter = LocaleFormatter(ui_locale)
+
+        # a fixed pool of event widgets that get relabelled, never rebuilt
+        self.events = [CalendarEvent(self.calendarEventContainer) for _ in range(calendar_event_count)]
+        self.shown = []
+
+        snapshot = scheduler.source.peek('calendar', 'local')
+        if snapshot is not None:
+            self.get_events(snapshot)
+        scheduler.watch('calendar', 'local', self.get_events, self.events_failed)
+
+    def events_failed(self, e):
+        print("Error: %s. Cannot get calendar events." % e)
+
+    def describe(self, event, today):
+        # e.g. 'Today 2:30 PM  Dentist', 'Tue 9:00 AM  Standup', 'Nov 04  Birthday'
+        start = datetime.fromisoformat(event['start'])
+        days = (start.date() - today).days
+        t = start.timetuple()
+        if days <= 0:
+            day = 'Today'
+        elif days == 1:
+            day = 'Tomorrow'
+        elif days < 7:
+            day = self.formatter.format('%a', t)
+        else:
+            day = self.formatter.format('%b %d', t)
+        if not event['all_day']:
+            day += ' ' + self.formatter.format('%I:%M %p' if time_format == 12 else '%H:%M', t).lstrip('0')
+        return '%s  %s' % (day, event['summary'])
+
+    def get_events(self, result):
+        # labels depend on today as well as the data, so they are worked out
+        # on every refresh and only the widgets whose text changed are touched
+        try:
+            today = datetime.now().date()
+            texts = [self.describe(event, today) for event in result.data[:calendar_event_count]]
+            if texts == self.shown:
+                return
+            for idx, widget in enumerate(self.events):
+                if idx < len(texts):
+                    widget.set_event_name(texts[idx])
+                    if idx >= len(self.shown):
+                        widget.pack(side=TOP, anchor=E)
+                elif idx < len(self.shown):
+                    widget.pack_forget()
+            self.shown = texts
+        except Exception as e:
+            traceback.print_exc()
+            print("Error: %s. Cannot get calendar events." % e)
 
 
 class CalendarEvent(Frame):
-    def __init__(self, parent, event_name="Event 1"):
+    def __init__(self, parent, event_name=""):
         Frame.__init__(self, parent, bg='black')
         self.eventName = event_name
         self.eventNameLbl = Label(self, text=self.eventName, font=('Helvetica', small_text_size), fg="white", bg="black")
         self.eventNameLbl.pack(side=TOP, anchor=E)
 
+    def set_event_name(self, event_name):
+        if event_name != self.eventName:
+            self.eventName = event_name
+            self.eventNameLbl.config(text=event_name)
+
 
 class FullscreenWindow:
 
@@ -501,32 +3167,80 @@ class FullscreenWindow:
         self.bottomFrame.pack(side=BOTTOM, fill=BOTH, expand=YES)
         self.state = False
 
+        validate_icons()
+
+        # fetches run off the Tk thread and report back through the scheduler,
+        # with one shared cache in front of every provider
+        if hub_url:
+            self.source = HubSource(hub_url)
+            self.scheduler = HubScheduler(self.tk, self.source)
+        else:
+            self.source = ReplaySource() if replay_dir else DataSource()
+            self.scheduler = FetchScheduler(self.tk, self.source)
+        # panel updates are spread over frames, and held while nobody looks
+        self.render = RenderScheduler(self.tk, self.scheduler)
+
+        # instrumentation: event-loop lag, memory budgets, cache counts, /metrics endpoint
+        self.lag_monitor = LoopLagMonitor(self.tk, render=self.render)
+        self.memory_guard = MemoryGuard(self.tk, self.source)
+        metrics.gauge('smartmirror_cache', lambda: [({'stat': stat}, value)
+                                                     for stat, value in self.source.cache.stats().items()])
+        self.metrics_server = start_metrics_server()
+        if metrics_log_interval:
+            self.log_metrics()
+
         # Set keys to maximize or minimize window
         self.tk.bind("<Return>", self.toggle_fullscreen)
         self.tk.bind("<Escape>", self.end_fullscreen)
 
-        # clock
-        self.clock = Clock(self.topFrame)
+        # clock goes up first so the mirror shows something right away
+        with startup_timer('build clock'):
+            self.clock = Clock(self.topFrame)
         self.clock.pack(side=RIGHT, anchor=N, padx=10, pady=20)
+        self.tk.after_idle(lambda: startup_timings.append(('first frame', time.perf_counter() - startup_start, 0)))
+
+        # Every other panel shows a placeholder while its modules are imported
+        # on the fetch pool, and is built on the Tk thread once they are in
+        panels = [('weather', Weather, self.topLeftFrame, dict(side=TOP, anchor=W, padx=10, pady=20)),
+                  ('surf', Surf, self.topLeftFrame, dict(side=TOP, anchor=W, padx=10, pady=0)),
+                  ('wind', Wind, self.topLeftFrame, dict(side=TOP, anchor=W, padx=10, pady=0)),
+                  ('news', News, self.bottomFrame, dict(side=LEFT, anchor=S, padx=100, pady=60))]
+        if calendar_paths:
+            panels.append(('calendar', Calendar, self.bottomFrame, dict(side=RIGHT, anchor=S, padx=100, pady=60)))
+        self.loading = len(panels)
+        for name, panel_class, parent, pack in panels:
+            placeholder = Label(parent, text='Loading %s...' % name, font=('Helvetica', small_text_size), fg="gray", bg="black")
+            placeholder.pack(**pack)
+            self.scheduler.submit(('startup', name), lambda names=panel_imports(name): import_modules(names),
+                                  lambda _, panel=(name, panel_class, placeholder, pack): self.build_panel(*panel),
+                                  lambda e, panel=(name, panel_class, placeholder, pack): self.panel_failed(e, *panel))
+
+    def build_panel(self, name, panel_class, placeholder, pack):
+        try:
+            with startup_timer('build %s' % name):
+                panel = panel_class(placeholder.master, self.scheduler)
+            panel.pack(after=placeholder, **pack)
+            placeholder.destroy()
+            setattr(self, name, panel)
+        except Exception as e:
+            traceback.print_exc()
+            self.panel_failed(e, name, panel_class, placeholder, pack)
+            return
+        self.panel_loaded()
 
-        # # weather
-        self.weather = Weather(self.topLeftFrame)
-        self.weather.pack(side=TOP, anchor=W, padx=10, pady=20)
-
-        # surf
-        self.surf = Surf(self.topLeftFrame)
-        self.surf.pack(side=TOP, anchor=W, padx=10, pady=0)
+    def panel_failed(self, e, name, panel_class, placeholder, pack):
+        print("Error: %s. Cannot load %s." % (e, name))
+        placeholder.config(text='%s unavailable' % name.title())
+        self.panel_loaded()
 
-        # wind
-        self.wind = Wind(self.topLeftFrame)
-        self.wind.pack(side=TOP, anchor=W, padx=10, pady=0)
+    def panel_loaded(self):
+        self.loading -= 1
+        if self.loading == 0:
+            print(startup_report())
 
-        # news
-        self.news = News(self.bottomFrame)
-        self.news.pack(side=LEFT, anchor=S, padx=100, pady=60)
-        # calender - removing for now
-        # self.calender = Calendar(self.bottomFrame)
-        # self.calender.pack(side = RIGHT, anchor=S, padx=100, pady=60)
+    def log_metrics(self):
+        print(metrics.render())
+        self.tk.after(int(metrics_log_interval * 1000), self.log_metrics)
 
     def toggle_fullscreen(self, event=None):
         self.state = not self.state  # Just toggling the boolean
@@ -541,9 +3255,15 @@ class FullscreenWindow:
 
 if __name__ == '__main__':
 
+    if '--hub' in sys.argv[1:]:
+        run_hub()
+        sys.exit()
+
     if os.environ.get('DISPLAY', '') == '':
         print('no display found. Using :0.0')
         os.environ.__setitem__('DISPLAY', ':0.0')
 
     w = FullscreenWindow()
     w.tk.mainloop()
+    w.scheduler.close()
+    w.source.close()